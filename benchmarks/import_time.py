@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import argparse
+import compileall
+import subprocess
+import numpy
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What a robot controller imports to load, evaluate and follow planned trajectories
+runtime_modules = ['core.trajectory', 'core.follower', 'core.trajectory_file', 'core.path']
+# None of these may be imported by the runtime modules
+forbidden_modules = ('scipy', 'matplotlib', 'pygame')
+
+
+# Imports module in a fresh interpreter with -X importtime
+# Returns the import time in seconds, the part of it spent importing numpy
+# and the names of all modules that ended up imported
+def measure_import(module):
+    code = 'import {0}; import sys; print(" ".join(sys.modules))'.format(module)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=root,
+                            capture_output=True, text=True, check=True)
+    total = 0
+    numpy_time = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Top level imports are only indented by one space
+        if name.startswith(' ') and not name.startswith('  '):
+            total += int(cumulative)
+        if name.strip() == 'numpy':
+            numpy_time = int(cumulative)
+    return total / 1e6, numpy_time / 1e6, result.stdout.split()
+
+
+# Median import times over repeats fresh interpreters, with and without numpy
+def import_report(modules, repeats=5):
+    # Compiling is a one time cost, keep it out of the measurement
+    compileall.compile_dir(os.path.join(root, 'core'), quiet=1)
+    report = {'python': sys.version.split()[0], 'numpy': numpy.__version__, 'results': {}}
+    for module in modules:
+        measurements = [measure_import(module) for _ in range(repeats)]
+        imported = measurements[-1][2]
+        report['results'][module] = {
+            'total': float(numpy.median([total for total, _, _ in measurements])),
+            'without_numpy': float(numpy.median([total - numpy_time for total, numpy_time, _ in measurements])),
+            'forbidden': sorted(name for name in imported if name.split('.')[0] in forbidden_modules),
+        }
+    return report
+
+
+# Checks the import times of the runtime modules against a budget (in milliseconds)
+# for the time spent outside numpy and makes sure none of them imports scipy,
+# matplotlib or pygame. Exits with 1 when any module is over budget
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of the runtime modules')
+    parser.add_argument('--budget', type=float, default=25, help='import time budget without numpy in ms')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('modules', nargs='*', default=runtime_modules)
+    args = parser.parse_args(argv)
+
+    report = import_report(args.modules, args.repeats)
+    report['budget'] = args.budget / 1000
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    failed = False
+    print('{0:25} {1:>10} {2:>14}'.format('module', 'total', 'without numpy'))
+    for module, result in report['results'].items():
+        over = result['without_numpy'] > report['budget']
+        print('{0:25} {1:>7.1f} ms {2:>11.1f} ms {3}'.format(module, 1000 * result['total'], 1000 * result['without_numpy'],
+                                                           'OVER BUDGET' if over else ''))
+        if result['forbidden']:
+            print('  imports {0}'.format(', '.join(result['forbidden'])))
+        failed = failed or over or bool(result['forbidden'])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
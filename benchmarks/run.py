@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import timeit
+import argparse
+import platform
+import tracemalloc
+import numpy
+
+from core.path import *
+from core.motion_profile import *
+from core.interp_lut import *
+
+# Where --save-baseline writes and --compare reads by default
+default_baseline = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Timing repeats of every benchmark, the median is compared against the baseline
+repeats = 5
+# Every repeat runs the benchmark at least this long (seconds)
+min_repeat_time = 0.05
+
+# Basic constraints, the same as the examples
+max_vel = 30
+max_acc = 40
+max_ang_vel = 3.14
+max_ang_acc = 3.14
+
+# name -> function that prepares a benchmark and returns the callable to time
+benchmarks = {}
+
+
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+# Waypoints and tangent angles (in degrees) of a random walk path with num_points waypoints
+def random_waypoints(num_points, seed=0):
+    rng = numpy.random.default_rng(seed)
+    angles = numpy.cumsum(rng.uniform(-60, 60, num_points))
+    steps = rng.uniform(10, 20, (num_points - 1, 1)) * numpy.column_stack((numpy.cos(numpy.radians(angles[:-1])),
+                                                                           numpy.sin(numpy.radians(angles[:-1]))))
+    points = numpy.vstack(([0, 0], numpy.cumsum(steps, axis=0)))
+    return points.tolist(), angles.tolist()
+
+
+def random_path(num_points, seed=0):
+    path = Path()
+    path.make_path(*random_waypoints(num_points, seed))
+    return path
+
+
+# ----- SEGMENTS -----
+for num_points in (5, 50):
+    @benchmark('segment_construction[{0}]'.format(num_points))
+    def _(num_points=num_points):
+        return lambda: random_path(num_points)
+
+    @benchmark('segment_compute_coeffs[{0}]'.format(num_points))
+    def _(num_points=num_points):
+        x_derivs, y_derivs = segment_derivs(*random_waypoints(num_points))
+
+        def run():
+            for i in range(len(x_derivs)):
+                Segment().compute_coeffs(x_derivs[i], y_derivs[i])
+        return run
+
+
+@benchmark('arc_length_inversion_scalar')
+def _():
+    segment = random_path(2).segments[0]
+    disps = numpy.linspace(0, segment.length, 100).tolist()
+
+    def run():
+        for disp in disps:
+            segment.parameter_at_displacement(disp)
+    return run
+
+
+@benchmark('arc_length_inversion_batch')
+def _():
+    segment = random_path(2).segments[0]
+    disps = numpy.linspace(0, segment.length, 10000)
+    return lambda: segment.parameters_at_displacements(disps)
+
+
+# ----- PATH QUERIES -----
+for query in ('point', 'curvature', 'first_deriv', 'heading', 'sample'):
+    @benchmark('path_{0}_at_displacement'.format(query))
+    def _(query=query):
+        path = random_path(20)
+        method = getattr(path, query + '_at_displacement')
+        disps = numpy.linspace(0, path.length, 100).tolist()
+
+        def run():
+            for disp in disps:
+                method(disp)
+        return run
+
+
+@benchmark('path_samples_at_displacements')
+def _():
+    path = random_path(20)
+    disps = numpy.linspace(0, path.length, 10000)
+    return lambda: path.samples_at_displacements(disps)
+
+
+# ----- MOTION PROFILES -----
+for num_points in (5, 50):
+    for planning_points in (100, 1000, 10000):
+        @benchmark('make_profile[{0}x{1}]'.format(num_points, planning_points))
+        def _(num_points=num_points, planning_points=planning_points):
+            path = random_path(num_points)
+
+            def run():
+                motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
+                motion_profile.make_profile(0, 0, planning_points)
+            return run
+
+
+# ----- LOOKUP TABLES -----
+@benchmark('interp_lut_lookup')
+def _():
+    x = numpy.linspace(0, 10, 1000)
+    lut = InterpLUT(x, numpy.sin(x))
+    queries = numpy.random.default_rng(0).uniform(0, 10, 1000).tolist()
+
+    def run():
+        for query in queries:
+            lut.lookup(query)
+    return run
+
+
+@benchmark('interp_lut_cursor')
+def _():
+    x = numpy.linspace(0, 10, 1000)
+    lut = InterpLUT(x, numpy.sin(x))
+    queries = numpy.linspace(0, 10, 1000).tolist()
+
+    def run():
+        cursor = lut.cursor()
+        for query in queries:
+            cursor.lookup(query)
+    return run
+
+
+# Times one benchmark and measures the peak memory of a single call
+# Returns seconds per call (minimum and median of the repeats) and peak bytes
+def measure(run):
+    timer = timeit.Timer(run)
+    number = 1
+    while timer.timeit(number) < min_repeat_time:
+        number *= 2
+    times = [time / number for time in timer.repeat(repeats, number)]
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'min': min(times), 'median': float(numpy.median(times)), 'number': number, 'peak_memory': peak}
+
+
+def run_benchmarks(selected=None):
+    results = {}
+    for name, setup in benchmarks.items():
+        if selected and not any(pattern in name for pattern in selected):
+            continue
+        results[name] = measure(setup())
+    return {
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'results': results,
+    }
+
+
+# Benchmarks whose median time or peak memory grew by more than the thresholds
+# (relative, 0.2 = 20%) compared to the baseline. The baseline can override the
+# time threshold of single benchmarks with a 'thresholds' dict
+# Returns a list of (name, measure, baseline value, new value)
+def regressions(report, baseline, time_threshold, memory_threshold):
+    found = []
+    thresholds = baseline.get('thresholds', {})
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]
+        if result['median'] > old['median'] * (1 + thresholds.get(name, time_threshold)):
+            found.append((name, 'median', old['median'], result['median']))
+        if result['peak_memory'] > old['peak_memory'] * (1 + memory_threshold):
+            found.append((name, 'peak_memory', old['peak_memory'], result['peak_memory']))
+    return found
+
+
+def print_report(report, baseline=None):
+    print('{0:40} {1:>12} {2:>12} {3:>12} {4:>8}'.format('benchmark', 'median', 'min', 'peak memory', 'change'))
+    for name, result in report['results'].items():
+        change = ''
+        if baseline is not None and name in baseline['results']:
+            change = '{0:+7.1f}%'.format(100 * (result['median'] / baseline['results'][name]['median'] - 1))
+        print('{0:40} {1:>9.3f} ms {2:>9.3f} ms {3:>9.1f} kB {4:>8}'.format(
+            name, 1000 * result['median'], 1000 * result['min'], result['peak_memory'] / 1024, change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the planning pipeline')
+    parser.add_argument('-k', dest='selected', action='append', help='only run benchmarks containing this text')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=default_baseline, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='fail when slower than the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown of the median time')
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help='allowed relative growth of the peak memory')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.selected)
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        # Keep the per benchmark thresholds of the old baseline
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                report['thresholds'] = json.load(file).get('thresholds', {})
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        if baseline is None:
+            print('No baseline at {0}, run with --save-baseline first'.format(args.baseline))
+            return 1
+        found = regressions(report, baseline, args.threshold, args.memory_threshold)
+        for name, measure_name, old, new in found:
+            print('REGRESSION {0} {1}: {2:.6g} -> {3:.6g}'.format(name, measure_name, old, new))
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
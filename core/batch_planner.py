@@ -0,0 +1,55 @@
+import multiprocessing
+from core.trajectory_file import *
+
+
+# Everything needed to plan one trajectory, kept as small arrays
+# so jobs are cheap to send to worker processes.
+# headings: list of (heading_deg, InterpolatorType), or empty to skip headings
+class PlanningJob:
+    def __init__(self, points, tangents, headings, max_vel, max_acc, max_ang_vel, max_ang_acc,
+                 start_vel=0, end_vel=0, num_points=200):
+        self.points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        self.tangents = numpy.asarray(tangents, dtype=float)
+        self.headings = numpy.array([[heading, type.value] for heading, type in headings], dtype=float).reshape(-1, 2)
+        self.constraints = numpy.array([max_vel, max_acc, max_ang_vel, max_ang_acc], dtype=float)
+        self.start_vel = start_vel
+        self.end_vel = end_vel
+        self.num_points = num_points
+
+
+# Makes a job from the waypoints of a PathBuilder
+def planning_job(path_builder, max_vel, max_acc, max_ang_vel, max_ang_acc, start_vel=0, end_vel=0, num_points=200):
+    return PlanningJob(path_builder.points, path_builder.tangent_angles, path_builder.headings,
+                       max_vel, max_acc, max_ang_vel, max_ang_acc, start_vel, end_vel, num_points)
+
+
+# Plans a single job in the current process
+def plan_job(job):
+    headings = [(heading, InterpolatorType(int(type))) for heading, type in job.headings.tolist()]
+    path = Path()
+    path.make_path(job.points.tolist(), job.tangents.tolist(), headings)
+    motion_profile = MotionProfile(path, *job.constraints.tolist())
+    motion_profile.make_profile(job.start_vel, job.end_vel, job.num_points)
+    return motion_profile
+
+
+# Runs in the worker processes. Results go back as the plain arrays
+# of motion_profile_arrays instead of pickled Segment objects
+def plan_indexed_job(indexed_job):
+    index, job = indexed_job
+    motion_profile = plan_job(job)
+    return index, motion_profile_arrays(motion_profile), motion_profile.path.skip_headings, job.constraints
+
+
+# Plans many jobs across a pool of processes (one per core by default)
+# Yields (job index, MotionProfile) as soon as each job is done,
+# or in the order of jobs when ordered is True
+def plan_batch(jobs, processes=None, ordered=False, chunksize=1):
+    indexed_jobs = list(enumerate(jobs))
+    with multiprocessing.Pool(processes) as pool:
+        if ordered:
+            results = pool.imap(plan_indexed_job, indexed_jobs, chunksize)
+        else:
+            results = pool.imap_unordered(plan_indexed_job, indexed_jobs, chunksize)
+        for index, sections, skip_headings, constraints in results:
+            yield index, motion_profile_from_arrays(sections, skip_headings, constraints.tolist())
@@ -0,0 +1,144 @@
+import time
+import numpy
+
+
+# Pose, velocity and acceleration the robot should have at time t
+class Setpoint:
+    __slots__ = ('t', 's', 'x', 'y', 'heading', 'v', 'a', 'vx', 'vy', 'ax', 'ay')
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, 0.0)
+
+
+# Running statistics of how long each tick took, in seconds.
+# The last window latencies are kept for percentiles
+class LatencyStats:
+    def __init__(self, window=4096):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.window = numpy.zeros(window)
+
+    def record(self, latency):
+        self.window[self.count % len(self.window)] = latency
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        return float(numpy.percentile(self.window[:min(self.count, len(self.window))], q))
+
+    # Counts of the kept latencies in bins, as returned by numpy.histogram
+    def histogram(self, bins=10):
+        return numpy.histogram(self.window[:min(self.count, len(self.window))], bins)
+
+    def summary(self):
+        return {
+            'ticks': self.count,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+
+# Iterates over the setpoints of a trajectory every period seconds,
+# ending with the final state of the trajectory.
+# Each tick only moves a cursor forward, so it is O(1), and the same
+# Setpoint object is updated in place every tick instead of allocating a new one.
+# With realtime set, every tick waits until its time has come on the wall clock
+class SetpointStream:
+    def __init__(self, trajectory, period, realtime=False):
+        if period <= 0:
+            raise ValueError('The controller period must be positive')
+        if len(trajectory) < 2:
+            raise ValueError('A trajectory needs at least two samples to be followed')
+        self.trajectory = trajectory
+        self.period = period
+        self.realtime = realtime
+        self.setpoint = Setpoint()
+        self.latency = LatencyStats()
+
+        # Element access on memoryviews gives plain floats without numpy scalar overhead
+        self.t = memoryview(numpy.ascontiguousarray(trajectory.t))
+        self.s = memoryview(numpy.ascontiguousarray(trajectory.s))
+        self.v = memoryview(numpy.ascontiguousarray(trajectory.v))
+        self.a = memoryview(numpy.ascontiguousarray(trajectory.a))
+        self.x = memoryview(numpy.ascontiguousarray(trajectory.x))
+        self.y = memoryview(numpy.ascontiguousarray(trajectory.y))
+        self.heading = memoryview(numpy.ascontiguousarray(trajectory.heading))
+        self.vx = memoryview(numpy.ascontiguousarray(trajectory.vx))
+        self.vy = memoryview(numpy.ascontiguousarray(trajectory.vy))
+        self.ax = memoryview(numpy.ascontiguousarray(trajectory.ax))
+        self.ay = memoryview(numpy.ascontiguousarray(trajectory.ay))
+
+        self.start_time = self.t[0]
+        self.end_time = self.t[len(self.t) - 1]
+        self.idx = 1
+        self.tick = 0
+        self.finished = False
+        self.wall_start = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        if self.realtime:
+            if self.wall_start is None:
+                self.wall_start = time.perf_counter()
+            delay = self.wall_start + self.tick * self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        tick_start = time.perf_counter()
+        t = self.start_time + self.tick * self.period
+        self.tick += 1
+        if t >= self.end_time:
+            t = self.end_time
+            self.finished = True
+
+        times = self.t
+        last = len(times) - 1
+        while self.idx < last and t > times[self.idx]:
+            self.idx += 1
+        self.__interpolate(t, self.idx)
+
+        self.latency.record(time.perf_counter() - tick_start)
+        return self.setpoint
+
+    # Fills the setpoint between samples i - 1 and i, where the acceleration
+    # is constant, so s and v follow exactly. Positions and heading are
+    # interpolated by displacement, the velocity components by time
+    def __interpolate(self, t, i):
+        setpoint = self.setpoint
+        t0 = self.t[i - 1]
+        dt = t - t0
+        span = self.t[i] - t0
+        time_fraction = dt / span if span > 0 else 1.0
+        a = self.a[i]
+
+        s0 = self.s[i - 1]
+        s = s0 + self.v[i - 1] * dt + 0.5 * a * dt * dt
+        ds = self.s[i] - s0
+        disp_fraction = (s - s0) / ds if ds > 0 else 1.0
+
+        setpoint.t = t
+        setpoint.s = s
+        setpoint.v = self.v[i - 1] + a * dt
+        setpoint.a = a
+        setpoint.x = self.x[i - 1] + disp_fraction * (self.x[i] - self.x[i - 1])
+        setpoint.y = self.y[i - 1] + disp_fraction * (self.y[i] - self.y[i - 1])
+        setpoint.heading = self.heading[i - 1] + disp_fraction * (self.heading[i] - self.heading[i - 1])
+        setpoint.vx = self.vx[i - 1] + time_fraction * (self.vx[i] - self.vx[i - 1])
+        setpoint.vy = self.vy[i - 1] + time_fraction * (self.vy[i] - self.vy[i - 1])
+        setpoint.ax = self.ax[i]
+        setpoint.ay = self.ay[i]
@@ -0,0 +1,90 @@
+import time
+from contextlib import contextmanager
+
+# Optional counters and stage timers for the hot paths of planning.
+# Every instrumented site first checks instrumentation.collector, so with no
+# instrumented() block active the cost is a single attribute test.
+#
+# Counters:
+#   arc_length_integrations   Gauss-Legendre interval integrals of the segment speed
+#   root_find_iterations      Newton iterations of t(s) times the parameters solved for
+#   projection_iterations     Newton iterations of path projections
+#   segment_lookups           displacements mapped to their segment
+# Stages (seconds), see MotionProfile.make_profile:
+#   limit_sampling, forward_pass, backward_pass, time_integration
+
+
+# Counts and stage times gathered inside an instrumented() block
+class Collector:
+    def __init__(self, callback=None):
+        self.counters = {}
+        self.timings = {}
+        self.callback = callback
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        if self.callback is not None:
+            self.callback(stage, seconds)
+
+    def summary(self):
+        return {'counters': dict(self.counters), 'timings': dict(self.timings)}
+
+
+class Instrumentation:
+    def __init__(self):
+        self.collector = None
+
+    # Context manager timing one stage, does nothing when not collecting
+    def stage(self, name):
+        if self.collector is None:
+            return null_stage
+        return StageTimer(self.collector, name)
+
+
+class StageTimer:
+    __slots__ = ('collector', 'name', 'start')
+
+    def __init__(self, collector, name):
+        self.collector = collector
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.collector.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+null_stage = NullStage()
+instrumentation = Instrumentation()
+
+
+# Collects counters and stage timings of everything planned inside the block
+# and yields the Collector. callback(stage, seconds) is called as every stage
+# finishes, to forward timings to telemetry. Nested blocks collect separately,
+# the outer one does not see what the inner one collected.
+# Collection is global, so only instrument one thread at a time
+@contextmanager
+def instrumented(callback=None):
+    collector = Collector(callback)
+    previous = instrumentation.collector
+    instrumentation.collector = collector
+    try:
+        yield collector
+    finally:
+        instrumentation.collector = previous
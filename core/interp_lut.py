@@ -1,7 +1,15 @@
+import numpy
+
+# Linearly interpolated lookup table over increasing x values.
+# y can either hold one value per x or be an (N, k) array with one
+# column per channel, in which case every lookup returns all k channels
+# from a single search over the shared x axis
 class InterpLUT:
     def __init__(self, x, y):
-        self.x_values = x
-        self.y_values = y
+        self.x_values = numpy.asarray(x, dtype=float)
+        self.y_values = numpy.asarray(y, dtype=float)
+        if len(self.x_values) != len(self.y_values):
+            raise ValueError('The number of x values must match the number of y values')
 
     def lerp(self, x, x0, x1, y0, y1):
         return y0 + (x - x0) * (y1 - y0) / (x1 - x0)
@@ -12,11 +20,50 @@ class InterpLUT:
         if x >= self.x_values[-1]:
             return self.y_values[-1]
 
-        idx = 0
-        while x > self.x_values[idx]:
-            idx += 1
+        # First index with x <= x_values[idx]
+        idx = int(numpy.searchsorted(self.x_values, x, side='left'))
+        return self.interpolate(x, idx)
 
+    # Vectorized lookup for an array of x values
+    # Returns an (M,) array, or (M, k) for a multi-channel table
+    def lookup_many(self, xs):
+        xs = numpy.clip(numpy.asarray(xs, dtype=float), self.x_values[0], self.x_values[-1])
+        idx = numpy.clip(numpy.searchsorted(self.x_values, xs, side='left'), 1, len(self.x_values) - 1)
         x0, x1 = self.x_values[idx - 1], self.x_values[idx]
+        fraction = (xs - x0) / (x1 - x0)
+        if self.y_values.ndim > 1:
+            fraction = fraction[:, None]
         y0, y1 = self.y_values[idx - 1], self.y_values[idx]
+        return y0 + fraction * (y1 - y0)
+
+    # Interpolates between idx - 1 and idx
+    def interpolate(self, x, idx):
+        x0, x1 = self.x_values[idx - 1], self.x_values[idx]
+        y0, y1 = self.y_values[idx - 1], self.y_values[idx]
+        return self.lerp(x, x0, x1, y0, y1)
+
+    # Returns a cursor for queries with (mostly) increasing x
+    def cursor(self):
+        return InterpCursor(self)
+
+
+# Remembers where the previous lookup ended so increasing queries,
+# like the time of a trajectory follower, only step forward a few entries.
+# Going backwards falls back to a binary search
+class InterpCursor:
+    def __init__(self, lut):
+        self.lut = lut
+        self.idx = 1
+
+    def lookup(self, x):
+        x_values = self.lut.x_values
+        if x <= x_values[0]:
+            return self.lut.y_values[0]
+        if x >= x_values[-1]:
+            return self.lut.y_values[-1]
 
-        return self.lerp(x, x0, x1, y0, y1)
\ No newline at end of file
+        if x <= x_values[self.idx - 1]:
+            self.idx = int(numpy.searchsorted(x_values, x, side='left'))
+        while x > x_values[self.idx]:
+            self.idx += 1
+        return self.lut.interpolate(x, self.idx)
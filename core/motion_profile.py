@@ -1,4 +1,5 @@
 from core.path import *
+from core.trajectory import *
 import math
 
 class MotionProfile:
@@ -9,120 +10,276 @@ class MotionProfile:
         self.max_ang_vel = max_ang_vel
         self.max_ang_acc = max_ang_acc
 
-        self.time_profile_x = []
-        self.time_profile_y = []
-        self.time_profile_abs = []
-
         self.displacement_profile = []
 
-        self.heading_profile = []
+        self.trajectory = None
         self.duration = 0
 
+        self.planning_samples = None
+        self.planning_limits = None
+        self.boundary = None
+
     # Build the profile based on the kinematic constraints, path,
     # as well as initial and end velocities
-    def make_profile(self, start_vel, end_vel, num_points, start_acc=0, end_acc=0):
+    # Without a tolerance the num_points planning points are spread uniformly.
+    # With a velocity tolerance (same units as max_vel) num_points is only the
+    # starting resolution, see adaptive_planning_displacements
+    def make_profile(self, start_vel, end_vel, num_points, start_acc=0, end_acc=0, tolerance=None):
         # Place velocity planning points on the path
-        self.displacement_profile = []
-        for s in numpy.linspace(0, self.path.length, num_points):
-            planning_vel = self.max_vel
-            ci = self.path.curvature_at_displacement(s)
-            vmax_omega = 0
-            if abs(ci) < 0.001:
-                vmax_omega = float('inf')
-            else:
-                vmax_omega = self.max_ang_acc / abs(ci)
-            planning_vel = min(planning_vel, vmax_omega)
-            self.displacement_profile.append([s, planning_vel])
+        if tolerance is None:
+            planning_disps = numpy.linspace(0, self.path.length, num_points)
+        else:
+            planning_disps = self.adaptive_planning_displacements(num_points, tolerance, start_vel, end_vel)
+        # Query the path for all planning points at once
+        with instrumentation.stage('limit_sampling'):
+            samples = self.path.samples_at_displacements(planning_disps)
+            planning_limits = curvature_limited_velocities(samples.curvature, self.max_vel, self.max_ang_acc)
 
         # Add the start and end velocities
-        self.displacement_profile[0] = [0.0, start_vel]
-        self.displacement_profile[num_points - 1] = [self.path.length, end_vel]
-
-        # ----- FORWARD PASS -----
-        for i in range(1, num_points):
-            current_point = self.displacement_profile[i]
-            prev_point = self.displacement_profile[i-1]
-            # The velocity of the current point must be adjusted if its too high
-            # i.e. we cannot accelerate from the previous point to this one
-            if current_point[1] <= prev_point[1]:
-                # nothing to do here because its less or equal (we don't accelerate)
-                continue
-            current_vel = current_point[1]
-            prev_vel = prev_point[1]
-            ds = current_point[0] - prev_point[0]
-            current_max_vel = math.sqrt(prev_vel ** 2 + 2 * self.max_acc * ds)
-
-            self.displacement_profile[i][1] = min(current_max_vel, current_vel)
-
-        # ----- BACKWARDS PASS -----
-        for i in range(num_points - 1, 0, -1):
-            current_point = self.displacement_profile[i]
-            prev_point = self.displacement_profile[i-1]
-            # The velocity of the previous point must be adjusted if its too high
-            # i.e. we cannot decelerate from the previous point to the current one
-            if current_point[1] >= prev_point[1]:
-                # nothing to do here because its greater or equal (we don't decelerate)
-                continue
-            current_vel = current_point[1]
-            prev_vel = prev_point[1]
-            ds = current_point[0] - prev_point[0]
-            prev_max_vel = math.sqrt(current_vel ** 2 + 2 * self.max_acc * ds)
-
-            self.displacement_profile[i -1][1] = min(prev_max_vel, prev_point[1])
+        planning_disps[0], planning_disps[-1] = 0.0, self.path.length
+        planning_vels = planning_limits.copy()
+        planning_vels[0], planning_vels[-1] = start_vel, end_vel
+
+        # ----- FORWARD AND BACKWARDS PASSES -----
+        with instrumentation.stage('forward_pass'):
+            planning_vels = forward_pass(planning_disps, planning_vels, self.max_acc)
+        with instrumentation.stage('backward_pass'):
+            planning_vels = backward_pass(planning_disps, planning_vels, self.max_acc)
+        self.displacement_profile = numpy.column_stack((planning_disps, planning_vels))
+
+        # Kept so update_profile can patch the profile after path edits
+        self.planning_samples = samples
+        self.planning_limits = planning_limits
+        self.boundary = (start_vel, end_vel, start_acc)
 
         # ----- TIME PROFILE CREATION-----
-        self.time_profile_abs.append([0.0, KinematicState(0, start_vel, start_acc)])
-        tangent_vector = numpy.array(self.path.first_deriv_at_displacement(0))
-        # normalize it, it should never be 0
-        tangent_vector /= numpy.linalg.norm(tangent_vector)
+        with instrumentation.stage('time_integration'):
+            data = self.__time_profile(planning_disps, planning_vels, samples, 0, start_acc)
+        self.trajectory = Trajectory(data)
+        self.duration = float(data[0, -1])
+        return self.trajectory
 
-        self.time_profile_x.append([0, KinematicState(0, start_vel * tangent_vector[0], start_acc * tangent_vector[0])])
-        self.time_profile_y.append([0, KinematicState(0, start_vel * tangent_vector[1], start_acc * tangent_vector[1])])
+    # Updates a made profile after a path edit, given the (start, old_end, new_end)
+    # range returned by Path.update_waypoint, insert_waypoint or remove_waypoint.
+    # Planning points outside the edited range are kept (shifted after it) and only
+    # the edited range is sampled again, at the average spacing of the profile
+    def update_profile(self, edit):
+        if self.planning_samples is None:
+            raise ValueError('The profile must be made with make_profile before it can be updated')
+        start, old_end, new_end = edit
+        start_vel, end_vel, start_acc = self.boundary
+        old_disps = self.displacement_profile[:, 0]
+        shift = new_end - old_end
 
-        if self.path.skip_headings is True:
-            self.heading_profile.append([0, 0])
-        else:
-            self.heading_profile.append([0, math.radians(self.path.headings[0][0])])
+        # Old points [0, left) and [right, end) are kept
+        left = int(numpy.searchsorted(old_disps, start, side='left'))
+        right = int(numpy.searchsorted(old_disps, old_end, side='right'))
+        spacing = old_disps[-1] / (len(old_disps) - 1)
+        region = numpy.linspace(start, new_end, max(int(round((new_end - start) / spacing)) + 1, 2))
+        region_samples = self.path.samples_at_displacements(region)
+        region_limits = curvature_limited_velocities(region_samples.curvature, self.max_vel, self.max_ang_acc)
+
+        right_samples = slice_samples(self.planning_samples, right, None)
+        right_samples.displacement = right_samples.displacement + shift
+        samples = concatenate_samples([slice_samples(self.planning_samples, 0, left), region_samples, right_samples])
+        disps = numpy.concatenate((old_disps[:left], region, old_disps[right:] + shift))
+        limits = numpy.concatenate((self.planning_limits[:left], region_limits, self.planning_limits[right:]))
+        vels = limits.copy()
+        vels[0], vels[-1] = start_vel, end_vel
+
+        # ----- FORWARD AND BACKWARDS PASSES -----
+        # Both are single scans over the planning points, far cheaper than the
+        # path queries saved above, so they are simply run again over everything
+        planning_vels = backward_pass(disps, forward_pass(disps, vels, self.max_acc), self.max_acc)
+        self.displacement_profile = numpy.column_stack((disps, planning_vels))
+        self.planning_samples = samples
+        self.planning_limits = limits
 
-        prev_time = 0
+        # ----- TIME PROFILE CREATION-----
+        data = self.__time_profile(disps, planning_vels, samples, 0, start_acc)
+        self.trajectory = Trajectory(data)
+        self.duration = float(data[0, -1])
+        return self.trajectory
+
+    # Plans with uniformly spread planning points like make_profile, but
+    # finalizes and yields consecutive Trajectory pieces of window points,
+    # so following can start while the rest of the path is still being planned.
+    # Each piece is planned together with the next lookahead points and a
+    # standstill at the end of them (end_vel at the end of the path), so
+    # stopping is always possible after any emitted piece.
+    # The result only matches make_profile when the lookahead points cover the
+    # braking distance from max_vel, a shorter lookahead makes every piece slow
+    # down for the standstill at its horizon.
+    # Once exhausted, trajectory and displacement_profile hold the whole profile,
+    # which update_profile cannot update
+    def make_profile_streaming(self, start_vel, end_vel, num_points, window=50, lookahead=100, start_acc=0):
+        # Without lookahead every piece ends at a standstill, and a piece of
+        # two points standing still never gets anywhere
+        if window < 1 or lookahead < 1:
+            raise ValueError('The window and the lookahead must contain at least one point')
+        # Streamed profiles are not planned in one piece, update_profile cannot patch them
+        self.planning_samples = None
+        self.planning_limits = None
+        self.boundary = None
+        planning_disps = numpy.linspace(0, self.path.length, num_points)
+        pieces = []
+        profile = []
+        start = 0
+        current_vel = start_vel
         current_time = 0
-        for i in range(1, num_points):
-            current_point = self.displacement_profile[i]
-            prev_point = self.displacement_profile[i-1]
+        # Samples and curvature limits of the planning points [first, queried].
+        # Every path query fetches at least as many points ahead as were
+        # already fetched, so a path takes a handful of queries instead of
+        # one per piece, and the first piece only waits for its own horizon
+        first = 0
+        queried = -1
+        samples = None
+        limits = numpy.empty(0)
+        while start < num_points - 1:
+            stop = min(start + window, num_points - 1)
+            horizon = min(stop + lookahead, num_points - 1)
+
+            if horizon > queried:
+                end = min(max(horizon, 2 * queried), num_points - 1)
+                new_samples = self.path.samples_at_displacements(planning_disps[queried + 1:end + 1])
+                new_limits = curvature_limited_velocities(new_samples.curvature, self.max_vel, self.max_ang_acc)
+                if samples is None:
+                    samples = new_samples
+                else:
+                    samples = concatenate_samples([slice_samples(samples, start - first, None), new_samples])
+                limits = numpy.concatenate((limits[start - first:], new_limits))
+                first = start
+                queried = end
+
+            disps = planning_disps[start:horizon + 1]
+            piece_samples = slice_samples(samples, start - first, horizon - first + 1)
+            vels = limits[start - first:horizon - first + 1].copy()
+            vels[0] = current_vel
+            vels[-1] = end_vel if horizon == num_points - 1 else 0
+            vels = backward_pass(disps, forward_pass(disps, vels, self.max_acc), self.max_acc)
+
+            # Only the points up to stop are final
+            count = stop - start + 1
+            data = self.__time_profile(disps[:count], vels[:count], piece_samples, current_time,
+                                       start_acc if start == 0 else 0)
+            if start > 0:
+                # The first point was the last point of the previous piece
+                data = data[:, 1:]
+            piece = Trajectory(data)
+            pieces.append(data)
+            profile.append(numpy.column_stack((piece.s, piece.v)))
 
-            current_vel = current_point[1]
-            prev_vel = prev_point[1]
+            start = stop
+            current_vel = vels[count - 1]
+            current_time = piece.t[-1]
+            yield piece
+
+        data = numpy.concatenate(pieces, axis=1)
+        self.trajectory = Trajectory(data)
+        self.displacement_profile = numpy.concatenate(profile)
+        self.duration = float(data[0, -1])
+
+    # Trajectory data for planning points with their final velocities, starting at start_time
+    # samples are the path samples of (at least) the planning points
+    def __time_profile(self, planning_disps, planning_vels, samples, start_time, start_acc):
+        num_points = len(planning_disps)
+        data = numpy.zeros((len(trajectory_fields), num_points))
+        t, s, v, a, vx, vy, ax, ay, heading, x, y = data
+        s[:] = planning_disps
+        x[:], y[:] = samples.position[:num_points, 0], samples.position[:num_points, 1]
+        v[:] = planning_vels
+
+        # Constant acceleration between planning points gives dt = 2 * ds / (v0 + v1)
+        dt = 2 * numpy.diff(planning_disps) / (planning_vels[:-1] + planning_vels[1:])
+        t[0] = start_time
+        numpy.cumsum(dt, out=t[1:])
+        t[1:] += start_time
+        a[0] = start_acc
+        a[1:] = numpy.diff(planning_vels) / dt
+
+        heading[:] = samples.heading[:num_points]
+        if planning_disps[0] == 0:
+            if self.path.skip_headings is True:
+                heading[0] = 0
+            else:
+                heading[0] = math.radians(self.path.headings[0][0])
 
-            ds = current_point[0] - prev_point[0]
-            dt = 2 * ds / (current_vel + prev_vel)
+        # Split velocity and acceleration along the unit tangent
+        tangent_vectors = samples.tangent[:num_points]
+        vx[:], vy[:] = v * tangent_vectors[:, 0], v * tangent_vectors[:, 1]
+        ax[:], ay[:] = a * tangent_vectors[:, 0], a * tangent_vectors[:, 1]
+        return data
 
-            current_time += dt
+    # Starts from num_points uniformly spread planning points and keeps halving
+    # the intervals whose midpoint velocity is off by more than tolerance:
+    # - the curvature limit at the midpoint against the interpolation of the
+    #   limits at the ends, which refines where the curvature changes quickly
+    # - the velocity implied by constant acceleration between the ends against
+    #   what the midpoint limit and max_acc from both ends allow, which catches
+    #   accelerate-then-brake humps hidden inside an interval
+    # Straight stretches keep the coarse spacing, tight turns get refined.
+    # The analytic curvature extrema of the path are always planning points,
+    # so no curvature peak can fall between two coarse points
+    def adaptive_planning_displacements(self, num_points, tolerance, start_vel, end_vel, max_depth=16):
+        extrema_disps, _ = self.path.curvature_extrema()
+        disps = numpy.union1d(numpy.linspace(0, self.path.length, max(num_points, 2)),
+                              numpy.clip(extrema_disps, 0, self.path.length))
+        midpoints = (disps[:-1] + disps[1:]) / 2
+        limits, midpoint_limits = numpy.split(self.__curvature_limits(numpy.concatenate((disps, midpoints))), [len(disps)])
+        for _ in range(max_depth):
+            vels = limits.copy()
+            vels[0], vels[-1] = start_vel, end_vel
+            vels = backward_pass(disps, forward_pass(disps, vels, self.max_acc), self.max_acc)
 
-            tangent_vector = numpy.array(self.path.first_deriv_at_displacement(current_point[0]))
-            # Normalize it, it should never be 0
-            tangent_vector /= numpy.linalg.norm(tangent_vector)
+            reachable = numpy.sqrt(numpy.minimum(vels[:-1], vels[1:]) ** 2 + self.max_acc * numpy.diff(disps))
+            implied = numpy.sqrt((vels[:-1] ** 2 + vels[1:] ** 2) / 2)
+            refine = (numpy.abs(numpy.minimum(midpoint_limits, reachable) - implied) > tolerance) | \
+                     (numpy.abs(midpoint_limits - (limits[:-1] + limits[1:]) / 2) > tolerance)
+            if not refine.any():
+                break
 
-            v_x = current_vel * tangent_vector[0]
-            v_y = current_vel * tangent_vector[1]
+            # Split the intervals at their midpoints, only the midpoints
+            # of the new halves have to be queried from the path
+            split_points = midpoints[refine]
+            left_midpoints = (disps[:-1][refine] + split_points) / 2
+            right_midpoints = (split_points + disps[1:][refine]) / 2
+            left_limits, right_limits = numpy.split(self.__curvature_limits(numpy.concatenate((left_midpoints, right_midpoints))), 2)
 
-            current_acc = (current_vel - prev_vel) / (current_time - prev_time)
+            positions = numpy.nonzero(refine)[0] + 1
+            disps = numpy.insert(disps, positions, split_points)
+            limits = numpy.insert(limits, positions, midpoint_limits[refine])
+            midpoint_limits[refine] = left_limits
+            midpoint_limits = numpy.insert(midpoint_limits, positions, right_limits)
+            midpoints = (disps[:-1] + disps[1:]) / 2
+        return disps
 
-            self.time_profile_abs.append([current_time,  KinematicState(current_point[0], current_vel, current_acc)])
+    def __curvature_limits(self, disps):
+        return curvature_limited_velocities(self.path.curvatures_at_displacements(disps), self.max_vel, self.max_ang_acc)
 
-            self.time_profile_x.append([current_time, KinematicState(current_point[0], v_x, current_acc * tangent_vector[0])])
-            self.time_profile_y.append([current_time, KinematicState(current_point[0], v_y, current_acc * tangent_vector[1])])
 
-            self.heading_profile.append([current_time, self.path.heading_at_displacement(current_point[0])])
+# Caps the velocity so that the angular velocity needed
+# to follow the curvature stays within max_ang_acc
+def curvature_limited_velocities(curvatures, max_vel, max_ang_acc):
+    abs_curvatures = numpy.abs(curvatures)
+    vels = numpy.full(abs_curvatures.shape, float(max_vel))
+    curved = abs_curvatures >= 0.001
+    vels[curved] = numpy.minimum(max_vel, max_ang_acc / abs_curvatures[curved])
+    return vels
 
-            prev_time = current_time
 
-        self.duration = current_time
-        return self.time_profile_x, self.time_profile_y
+# The forward pass caps every velocity so that it can be reached from the previous one:
+# v[i]^2 = min(v[i]^2, v[i-1]^2 + 2 * max_acc * ds)
+# With D = 2 * max_acc * s this is u[i] = min(v[i]^2 - D[i], u[i-1]),
+# i.e. a running minimum, so the whole pass is a single accumulate
+def forward_pass(disps, vels, max_acc):
+    reach = 2 * max_acc * (disps - disps[0])
+    squared = numpy.minimum.accumulate(vels ** 2 - reach) + reach
+    return numpy.sqrt(numpy.maximum(squared, 0))
 
 
-class KinematicState:
-    def __init__(self, position, velocity, acceleration=0, jerk=0):
-        self.position = position
-        self.velocity = velocity
-        self.acceleration = acceleration
-        self.jerk = jerk
+# The backwards pass caps every velocity so that the next one can still be reached
+# when braking at max_acc, which is the forward pass run from the end of the path
+def backward_pass(disps, vels, max_acc):
+    reach = 2 * max_acc * (disps - disps[0])
+    squared = numpy.minimum.accumulate((vels ** 2 + reach)[::-1])[::-1] - reach
+    return numpy.sqrt(numpy.maximum(squared, 0))
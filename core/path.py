@@ -1,32 +1,35 @@
 import math
+import bisect
 import numpy
 from core.segment import *
 from core.heading_interpolator import *
+from core.path_index import *
 
 class Path:
     def __init__(self):
         self.segments = []
         self.length = 0
         self.skip_headings = False
+        # Displacement at the start of every segment, plus the total length at the end
+        self.cumulative_lengths = [0]
+        # x and y polynomial coefficients of every segment, highest degree first
+        self.coefficients = numpy.empty((0, 2, 6))
+        # Spatial index for projections, built on first use
+        self.index = None
 
     def get_correct_segment(self, disp):
         # Immediately throw out absurd displacements
         if not in_range(disp, 0, self.length):
             raise ValueError(
                 'Incorrect displacement provided (must be between 0 and the total length)')
-        current_segment = Segment()
-        found = False
-        running_disp = 0
-        for segment in self.segments:
-            if disp >= running_disp and disp <= running_disp + segment.length:
-                current_segment = segment
-                found = True
-                break
-            running_disp += segment.length
-        if found is False:
+        if len(self.segments) == 0:
             raise ValueError(
-                'Fatal Error: Could not find the correct segment for displacement. Perhaps a numerical error?')
-        return current_segment, disp - running_disp
+                'Fatal Error: Could not find the correct segment for displacement. The path is empty')
+        if instrumentation.collector is not None:
+            instrumentation.collector.count('segment_lookups')
+        # First segment whose end is not before disp, the last one catches the tolerance past the end
+        segment_id = bisect.bisect_left(self.cumulative_lengths, disp, 1, len(self.segments)) - 1
+        return self.segments[segment_id], disp - self.cumulative_lengths[segment_id]
 
     # Returns a point on the path at a certain displacement
     def point_at_displacement(self, disp):
@@ -65,16 +68,214 @@ class Path:
         # Find out in which segment we are
         current_segment, relative_disp = self.get_correct_segment(disp)
         t = current_segment.parameter_at_displacement(relative_disp)
-        rt1 = numpy.array(current_segment.first_deriv_at_parameter(t))
-        rt2 = numpy.array(current_segment.second_deriv_at_parameter(t))
-        return (rt2 / (numpy.linalg.norm(rt1) ** 2)) - (rt1 * rt2 * rt1) / (numpy.linalg.norm(rt1) ** 4)
-    
+        return self.__sample_segment(current_segment, t, disp).second_deriv
+
+
     def heading_at_displacement(self, disp):
         # Find out in which segment we are
         current_segment, relative_disp = self.get_correct_segment(disp)
         t = current_segment.parameter_at_displacement(relative_disp)
         return current_segment.heading_interpolator.heading_at_parameter(t)
 
+    # Returns position, unit tangent, second derivative, curvature and heading
+    # at a certain displacement with a single segment lookup and parameter solve
+    def sample_at_displacement(self, disp):
+        current_segment, relative_disp = self.get_correct_segment(disp)
+        t = current_segment.parameter_at_displacement(relative_disp)
+        return self.__sample_segment(current_segment, t, disp)
+
+    # Batch version of sample_at_displacement
+    # The returned sample holds (N, 2) and (N,) arrays instead of single values
+    def samples_at_displacements(self, disps):
+        n = numpy.size(disps)
+        sample = PathSample(numpy.asarray(disps, dtype=float).reshape(n), numpy.empty((n, 2)), numpy.empty((n, 2)),
+                            numpy.empty((n, 2)), numpy.empty(n), numpy.empty(n))
+        for segment, indices, t in self.group_by_segment(disps):
+            segment_sample = self.__sample_segment(segment, t, None)
+            sample.position[indices] = segment_sample.position.T
+            sample.tangent[indices] = segment_sample.tangent.T
+            sample.second_deriv[indices] = segment_sample.second_deriv.T
+            sample.curvature[indices] = segment_sample.curvature
+            sample.heading[indices] = segment_sample.heading
+        return sample
+
+    # Evaluates a segment at parameter t, which can also be a numpy array
+    # in which case the vector fields are (2, N)
+    def __sample_segment(self, segment, t, disp):
+        rt0 = numpy.array(segment.point_at_parameter(t))
+        rt1 = numpy.array(segment.first_deriv_at_parameter(t))
+        rt2 = numpy.array(segment.second_deriv_at_parameter(t))
+        speed = numpy.hypot(rt1[0], rt1[1])
+        # Chain rule for d^2r/ds^2 with ds/dt = |r'(t)|
+        second_deriv = rt2 / speed ** 2 - rt1 * (rt1[0] * rt2[0] + rt1[1] * rt2[1]) / speed ** 4
+        return PathSample(disp, rt0, rt1 / speed, second_deriv, cross(rt1, rt2) / speed ** 3,
+                          segment.heading_interpolator.heading_at_parameter(t))
+
+    # Displacements where the curvature has a local extremum (inside segments)
+    # and the curvature there, from the analytic extrema of every segment
+    def curvature_extrema(self):
+        disps = []
+        curvatures = []
+        for segment, start in zip(self.segments, self.cumulative_lengths):
+            params, segment_curvatures = segment.curvature_extrema()
+            disps.append(start + segment.displacements_at_parameters(params))
+            curvatures.append(segment_curvatures)
+        if len(disps) == 0:
+            return numpy.empty(0), numpy.empty(0)
+        return numpy.concatenate(disps), numpy.concatenate(curvatures)
+
+    # Splits a numpy array of displacements by segment
+    # Returns a list of (segment, indices into disps, segment parameters)
+    # so every segment solves for all of its parameters at once
+    def group_by_segment(self, disps):
+        disps = numpy.asarray(disps, dtype=float)
+        if disps.size and not (in_range(disps.min(), 0, self.length) and in_range(disps.max(), 0, self.length)):
+            raise ValueError(
+                'Incorrect displacement provided (must be between 0 and the total length)')
+        if instrumentation.collector is not None:
+            instrumentation.collector.count('segment_lookups', disps.size)
+        cumulative_lengths = numpy.asarray(self.cumulative_lengths)
+        segment_ids = numpy.searchsorted(cumulative_lengths[1:-1], disps, side='left')
+
+        groups = []
+        for segment_id in numpy.unique(segment_ids):
+            segment = self.segments[segment_id]
+            indices = numpy.nonzero(segment_ids == segment_id)[0]
+            relative_disps = disps[indices] - cumulative_lengths[segment_id]
+            groups.append((segment, indices, segment.parameters_at_displacements(relative_disps)))
+        return groups
+
+    # Batch version of point_at_displacement, returns an (N, 2) array
+    def points_at_displacements(self, disps):
+        points = numpy.empty((numpy.size(disps), 2))
+        for segment, indices, t in self.group_by_segment(disps):
+            points[indices, 0], points[indices, 1] = segment.point_at_parameter(t)
+        return points
+
+    # Batch version of first_deriv_at_displacement, returns an (N, 2) array of unit vectors
+    def first_derivs_at_displacements(self, disps):
+        derivs = numpy.empty((numpy.size(disps), 2))
+        for segment, indices, t in self.group_by_segment(disps):
+            derivs[indices, 0], derivs[indices, 1] = segment.first_deriv_at_parameter(t)
+        return derivs / numpy.linalg.norm(derivs, axis=1)[:, None]
+
+    # Batch version of curvature_at_displacement, returns an (N,) array
+    def curvatures_at_displacements(self, disps):
+        curvatures = numpy.empty(numpy.size(disps))
+        for segment, indices, t in self.group_by_segment(disps):
+            rt1 = numpy.array(segment.first_deriv_at_parameter(t))
+            rt2 = numpy.array(segment.second_deriv_at_parameter(t))
+            curvatures[indices] = cross(rt1, rt2) / (numpy.hypot(rt1[0], rt1[1]) ** 3)
+        return curvatures
+
+    # Batch version of heading_at_displacement, returns an (N,) array
+    def headings_at_displacements(self, disps):
+        headings = numpy.empty(numpy.size(disps))
+        for segment, indices, t in self.group_by_segment(disps):
+            headings[indices] = segment.heading_interpolator.heading_at_parameter(t)
+        return headings
+
+    # ----- PROJECTION -----
+    # Closest point on the path to point, as a PathProjection.
+    # Without a hint the spatial index gives every segment point that could be the
+    # closest, which are refined with Newton's method on the segment polynomials.
+    # With hint, the displacement found on the previous control tick, only the closest
+    # point near the hint is refined: a few Newton iterations whatever the path length,
+    # and it keeps following the same part of a path that crosses itself
+    def project(self, point, hint=None):
+        x, y = float(point[0]), float(point[1])
+        if hint is None:
+            index = self.projection_index()
+            points = numpy.array([[x, y]])
+            params = index.candidates(points[0])
+            segment_ids, t = split_parameters(index.closest(points, numpy.zeros(len(params), dtype=int), params),
+                                              len(self.segments))
+            segment_id, t = int(segment_ids[0]), float(t[0])
+        else:
+            hint = min(max(hint, 0), self.length)
+            segment_id = bisect.bisect_left(self.cumulative_lengths, hint, 1, len(self.segments)) - 1
+            # Rough start, the Newton iterations fix it
+            segment_id, t = self.__refine(x, y, segment_id,
+                                          (hint - self.cumulative_lengths[segment_id]) / self.segments[segment_id].length)
+
+        segment = self.segments[segment_id]
+        px, py = segment.point_at_parameter(t)
+        dx, dy = segment.first_deriv_at_parameter(t)
+        # Positive to the left of the direction of travel
+        lateral_error = float((dx * (y - py) - dy * (x - px)) / math.hypot(dx, dy))
+        return PathProjection(self.cumulative_lengths[segment_id] + segment.displacement_at_parameter(t),
+                              segment_id, t, numpy.array([px, py]), lateral_error)
+
+    # Newton's method on (r(t) - point) . r'(t) = 0 for a single point, as PathIndex.refine
+    # but with plain floats, moving into the neighbouring segments when t leaves [0, 1]
+    def __refine(self, x, y, segment_id, t):
+        last_segment = len(self.segments) - 1
+        for iteration in range(max_projection_iterations):
+            segment = self.segments[segment_id]
+            px, py = segment.point_at_parameter(t)
+            dx, dy = segment.first_deriv_at_parameter(t)
+            ddx, ddy = segment.second_deriv_at_parameter(t)
+            ox, oy = px - x, py - y
+            gradient = ox * dx + oy * dy
+            hessian = dx * dx + dy * dy + ox * ddx + oy * ddy
+            # Away from a minimum, step downhill instead
+            step = -gradient / hessian if hessian > 0 else -math.copysign(max_projection_step, gradient)
+            step = min(max(step, -max_projection_step), max_projection_step)
+            t += step
+            if t < 0 and segment_id > 0:
+                segment_id, t = segment_id - 1, t + 1
+            elif t > 1 and segment_id < last_segment:
+                segment_id, t = segment_id + 1, t - 1
+            t = min(max(t, 0.0), 1.0)
+            if abs(step) < projection_tolerance:
+                break
+        if instrumentation.collector is not None:
+            instrumentation.collector.count('projection_iterations', iteration + 1)
+        return segment_id, t
+
+    # Batch version of project, points: (N, 2), hints: None or (N,) displacements
+    # The returned projection holds (N, 2) and (N,) arrays instead of single values
+    def project_many(self, points, hints=None):
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        index = self.projection_index()
+        if hints is None:
+            params = index.closest(points, *index.candidates_many(points))
+        else:
+            hints = numpy.clip(numpy.asarray(hints, dtype=float).reshape(-1), 0, self.length)
+            params = index.refine(points, self.parameters_at_displacements(hints))
+        return self.__projection(points, params)
+
+    # Projection of points onto the path at global parameters
+    def __projection(self, points, params):
+        index = self.projection_index()
+        segment_ids, t = split_parameters(params, len(self.segments))
+        disps = numpy.empty(len(params))
+        for segment_id in numpy.unique(segment_ids):
+            indices = numpy.nonzero(segment_ids == segment_id)[0]
+            disps[indices] = (self.cumulative_lengths[segment_id] +
+                              self.segments[segment_id].displacements_at_parameters(t[indices]))
+        positions = index.evaluate(index.coefficients, params)
+        derivs = index.evaluate(index.first_deriv, params)
+        tangents = derivs / numpy.linalg.norm(derivs, axis=1)[:, None]
+        # Positive to the left of the direction of travel
+        lateral_errors = cross(tangents.T, (points - positions).T)
+        return PathProjection(disps, segment_ids, t, positions, lateral_errors)
+
+    # Global parameters (segment index + segment parameter) at displacements, see PathIndex
+    def parameters_at_displacements(self, disps):
+        disps = numpy.asarray(disps, dtype=float)
+        params = numpy.searchsorted(numpy.asarray(self.cumulative_lengths)[1:-1], disps, side='left').astype(float)
+        for segment, indices, t in self.group_by_segment(disps):
+            params[indices] += t
+        return params
+
+    def projection_index(self):
+        if self.index is None:
+            if len(self.segments) == 0:
+                raise ValueError('Cannot project onto an empty path')
+            self.index = PathIndex(self.coefficients)
+        return self.index
+
     # Constructs a path of len(points)-1 segments
     # that passes through all points in the array.
     # All derivatives are given manually.
@@ -100,41 +301,121 @@ class Path:
             if points[i] == points[i-1]:
                 raise ValueError('Null segment error. Duplicate points found.')
 
-        for i in range(len(points) - 1):
-            # Make a segment between current_point and next_point
-            # with given tangents
-            current_start_x = points[i][0]
-            current_start_y = points[i][1]
-            current_deriv_angle = tangents[i]
-
-            next_start_x = points[i+1][0]
-            next_start_y = points[i+1][1]
-            next_deriv_angle = tangents[i+1]
-
-            # Tangent length heuristic from this paper:
-            # Lau, Boris & Sprunk, Christoph & Burgard, Wolfram. (2009). Kinodynamic Motion Planning for Mobile Robots Using Splines.
-            tangent_length = 0
-            if i == 0:
-                tangent_length = 0.5 * math.dist(points[i], points[i+1])
-            elif i == (len(points) - 2):
-                tangent_length = 0.5 * math.dist(points[i-1], points[i])
-            else:
-                tangent_length = min(math.dist(points[i], points[i-1]), math.dist(points[i], points[i+1]))
-        
+        # Solve for every segment at once, then integrate all their lengths together
+        coefficients = segment_coefficients(*segment_derivs(points, tangents))
+        tables = arc_length_tables(coefficients)
+        self.build_segments(coefficients, tables)
+
+    # Creates the segments from already computed (N, 2, 6) coefficients
+    # and N arc length tables, with the headings set in make_path
+    def build_segments(self, coefficients, tables):
+        self.extend_segments(self.make_segments(coefficients, tables, 0), coefficients)
+
+    # Segment objects for the segments starting at waypoint first
+    # headings are the waypoint headings to use, self.headings by default
+    def make_segments(self, coefficients, tables, first, headings=None):
+        if headings is None:
+            headings = self.headings
+        new_segments = []
+        for i in range(first, first + len(coefficients)):
             new_segment = Segment()
-            new_segment.compute_coeffs([current_start_x, tangent_length * math.cos(math.radians(current_deriv_angle)), 0,
-                                        next_start_x, tangent_length * math.cos(math.radians(next_deriv_angle)), 0],
-                                       [current_start_y, tangent_length * math.sin(math.radians(current_deriv_angle)), 0,
-                                        next_start_y, tangent_length * math.sin(math.radians(next_deriv_angle)), 0])
-            
+            new_segment.set_coeffs(coefficients[i - first, 0], coefficients[i - first, 1], tables[i - first])
+
             if not self.skip_headings:
                 new_segment.heading_interpolator = HeadingInterpolator(new_segment, math.radians(headings[i][0]), math.radians(headings[i+1][0]), headings[i+1][1])
             else:
                 new_segment.heading_interpolator = HeadingInterpolator(new_segment, 0, 0, InterpolatorType.CONSTANT)
-                
-            self.segments.append(new_segment)
+            new_segments.append(new_segment)
+        return new_segments
+
+    # ----- INCREMENTAL EDITING -----
+    # Because of the tangent length heuristic a waypoint only shapes the segments
+    # up to two before and one after it, so only those are recomputed.
+    # Every edit returns (start, old_end, new_end): the displacement range that
+    # changed, before and after the edit. Everything after old_end is unchanged
+    # and only shifted by new_end - old_end, which is what MotionProfile.update_profile needs
+
+    # Moves waypoint index, optionally changing its tangent angle and (heading_deg, InterpolatorType)
+    def update_waypoint(self, index, point, tangent=None, heading=None):
+        points, tangents, headings = list(self.points), list(self.tangents), list(self.headings)
+        points[index] = point
+        if tangent is not None:
+            tangents[index] = tangent
+        if heading is not None and not self.skip_headings:
+            headings[index] = heading
+        return self.rebuild_segments(points, tangents, headings, index - 2, index + 2, 0)
+
+    # Inserts a new waypoint before index
+    def insert_waypoint(self, index, point, tangent, heading=None):
+        points, tangents, headings = list(self.points), list(self.tangents), list(self.headings)
+        if not self.skip_headings:
+            if heading is None:
+                raise ValueError('This path has headings, so the new waypoint needs one too')
+            headings.insert(index, heading)
+        points.insert(index, point)
+        tangents.insert(index, tangent)
+        return self.rebuild_segments(points, tangents, headings, index - 2, index + 2, 1)
+
+    def remove_waypoint(self, index):
+        if len(self.points) == 2:
+            raise ValueError("A path must contain at least two points")
+        points, tangents, headings = list(self.points), list(self.tangents), list(self.headings)
+        del points[index]
+        del tangents[index]
+        if not self.skip_headings:
+            del headings[index]
+        return self.rebuild_segments(points, tangents, headings, index - 2, index + 1, -1)
+
+    # Recomputes the segments first to last - 1 (new numbering) for the edited
+    # waypoint lists, where the number of segments changed by added_segments.
+    # The path only takes the new waypoints once all of their segments are
+    # computed, so an edit that raises leaves the path as it was
+    def rebuild_segments(self, points, tangents, headings, first, last, added_segments):
+        num_segments = len(points) - 1
+        first = max(first, 0)
+        last = min(last, num_segments)
+        old_last = last - added_segments
+        for i in range(max(first - 1, 0), min(last + 1, len(points))):
+            if i > 0 and points[i] == points[i-1]:
+                raise ValueError('Null segment error. Duplicate points found.')
+
+        # The end derivatives of every segment are cheap, the coefficients
+        # and arc length integrals are only computed for the changed ones
+        x_derivs, y_derivs = segment_derivs(points, tangents)
+        coefficients = segment_coefficients(x_derivs[first:last], y_derivs[first:last])
+        new_segments = self.make_segments(coefficients, arc_length_tables(coefficients), first, headings)
+
+        self.points = points
+        self.tangents = tangents
+        self.headings = headings
+        start = self.cumulative_lengths[first]
+        old_end = self.cumulative_lengths[old_last]
+        self.segments[first:old_last] = new_segments
+        self.index = None
+        self.coefficients = numpy.concatenate((self.coefficients[:first], coefficients, self.coefficients[old_last:]))
+        self.cumulative_lengths = [0] + numpy.cumsum([segment.length for segment in self.segments]).tolist()
+        self.length = self.cumulative_lengths[-1]
+        return start, old_end, self.cumulative_lengths[last]
 
-            self.length += new_segment.length
+    # Adds a fully computed segment to the end of the path
+    def append_segment(self, segment):
+        coeffs = [[segment.xpoly.a, segment.xpoly.b, segment.xpoly.c, segment.xpoly.d, segment.xpoly.e, segment.xpoly.f],
+                  [segment.ypoly.a, segment.ypoly.b, segment.ypoly.c, segment.ypoly.d, segment.ypoly.e, segment.ypoly.f]]
+        self.extend_segments([segment], numpy.array([coeffs]))
+
+    # Adds computed segments with their (N, 2, 6) coefficients to the end of the path
+    # and extends the cumulative length index
+    def extend_segments(self, segments, coefficients):
+        self.segments.extend(segments)
+        self.index = None
+        if len(self.coefficients) == 0:
+            # Keep the caller's array (and its memory) when there is nothing to join
+            self.coefficients = coefficients
+        else:
+            self.coefficients = numpy.concatenate((self.coefficients, coefficients))
+        for segment in segments:
+            self.length += segment.length
+            self.cumulative_lengths.append(self.length)
 
     def plot_points(self, resolution):
         x_points = []
@@ -145,6 +426,262 @@ class Path:
             y_points += y_segment
         return x_points, y_points
 
+    # View of the part of the path between displacements start and end, see SubPath
+    def subpath(self, start, end):
+        return SubPath(self, start, end)
+
+
+# The part of a parent path between displacements start and end. It shares the
+# parent's segments, coefficients and arc length tables instead of copying them:
+# displacements along the view are offset by start and answered by the parent,
+# so the first and last segments are only used between start_parameter and
+# end_parameter. Views can be planned and queried like any path but not edited,
+# materialize() turns one into a standalone Path. A view is only valid until
+# its parent is edited
+class SubPath(Path):
+    def __init__(self, parent, start, end):
+        super().__init__()
+        if not (in_range(start, 0, parent.length) and in_range(end, 0, parent.length)) or end <= start:
+            raise ValueError('A sub-path needs 0 <= start < end <= the length of the path')
+        start, end = max(start, 0), min(end, parent.length)
+        self.parent = parent
+        self.offset = start
+        self.length = end - start
+        self.skip_headings = parent.skip_headings
+        self.standalone = None
+
+        # Segments containing start and end
+        first = bisect.bisect_right(parent.cumulative_lengths, start, 0, len(parent.segments)) - 1
+        last = bisect.bisect_left(parent.cumulative_lengths, end, 1, len(parent.segments)) - 1
+        self.first_segment = first
+        self.segments = parent.segments[first:last + 1]
+        self.coefficients = parent.coefficients[first:last + 1]
+        self.cumulative_lengths = [0] + [length - start for length in parent.cumulative_lengths[first + 1:last + 1]] + [self.length]
+        self.start_parameter = self.segments[0].parameter_at_displacement(start - parent.cumulative_lengths[first])
+        self.end_parameter = self.segments[-1].parameter_at_displacement(end - parent.cumulative_lengths[last])
+
+        # The ends of the view become waypoints, the parent's waypoints in between are kept
+        start_sample = parent.sample_at_displacement(start)
+        end_sample = parent.sample_at_displacement(end)
+        self.points = [start_sample.position.tolist()] + parent.points[first + 1:last + 1] + [end_sample.position.tolist()]
+        self.tangents = ([math.degrees(math.atan2(start_sample.tangent[1], start_sample.tangent[0]))] +
+                         parent.tangents[first + 1:last + 1] +
+                         [math.degrees(math.atan2(end_sample.tangent[1], end_sample.tangent[0]))])
+        if self.skip_headings:
+            self.headings = []
+        else:
+            self.headings = ([(math.degrees(start_sample.heading), InterpolatorType.CONSTANT)] +
+                             parent.headings[first + 1:last + 1] +
+                             [(math.degrees(end_sample.heading), parent.headings[last + 1][1])])
+
+    def get_correct_segment(self, disp):
+        if not in_range(disp, 0, self.length):
+            raise ValueError(
+                'Incorrect displacement provided (must be between 0 and the total length)')
+        return self.parent.get_correct_segment(min(max(disp, 0), self.length) + self.offset)
+
+    def group_by_segment(self, disps):
+        disps = numpy.asarray(disps, dtype=float)
+        if disps.size and not (in_range(disps.min(), 0, self.length) and in_range(disps.max(), 0, self.length)):
+            raise ValueError(
+                'Incorrect displacement provided (must be between 0 and the total length)')
+        return self.parent.group_by_segment(numpy.clip(disps, 0, self.length) + self.offset)
+
+    def curvature_extrema(self):
+        disps, curvatures = self.parent.curvature_extrema()
+        inside = (disps > self.offset) & (disps < self.offset + self.length)
+        return disps[inside] - self.offset, curvatures[inside]
+
+    def subpath(self, start, end):
+        if not (in_range(start, 0, self.length) and in_range(end, 0, self.length)):
+            raise ValueError('A sub-path needs 0 <= start < end <= the length of the path')
+        return SubPath(self.parent, self.offset + max(start, 0), self.offset + min(end, self.length))
+
+    # Projections onto the view run on its standalone path, which only
+    # holds the used parameter ranges of the end segments.
+    # Segments and parameters are returned for the parent's segments
+    def project(self, point, hint=None):
+        projection = self.materialize().project(point, hint)
+        projection.segment, projection.parameter = self.parent_parameter(projection.segment, projection.parameter)
+        return projection
+
+    def project_many(self, points, hints=None):
+        projection = self.materialize().project_many(points, hints)
+        projection.segment, projection.parameter = self.parent_parameter(projection.segment, projection.parameter)
+        return projection
+
+    # Segment index and parameter in the parent for a segment index and
+    # parameter of the standalone path (scalars or numpy arrays)
+    def parent_parameter(self, segment_id, t):
+        last = len(self.segments) - 1
+        start = numpy.where(segment_id == 0, self.start_parameter, 0)
+        end = numpy.where(segment_id == last, self.end_parameter, 1)
+        parameter = start + (end - start) * t
+        if numpy.ndim(parameter) == 0:
+            return int(segment_id) + self.first_segment, float(parameter)
+        return segment_id + self.first_segment, parameter
+
+    def plot_points(self, resolution):
+        points = self.points_at_displacements(numpy.linspace(0, self.length, resolution * len(self.segments) + 1))
+        return points[:, 0].tolist(), points[:, 1].tolist()
+
+    # Standalone Path of the view that shares the parent's inner Segment objects.
+    # Only the trimmed end segments are solved and integrated again
+    def materialize(self):
+        if self.standalone is None:
+            last = len(self.segments) - 1
+            ranges = [(0, self.start_parameter, self.end_parameter if last == 0 else 1)]
+            if last > 0:
+                ranges.append((last, 0, self.end_parameter))
+            coefficients = numpy.array(self.coefficients)
+            for i, t0, t1 in ranges:
+                coefficients[i] = trim_coefficients(coefficients[i], t0, t1)
+            tables = arc_length_tables(coefficients[[i for i, _, _ in ranges]])
+
+            segments = list(self.segments)
+            for (i, t0, t1), table in zip(ranges, tables):
+                segment = Segment()
+                segment.set_coeffs(coefficients[i, 0], coefficients[i, 1], table)
+                interpolator = self.segments[i].heading_interpolator
+                segment.heading_interpolator = HeadingInterpolator(segment, interpolator.heading_at_parameter(t0),
+                                                                   interpolator.heading_at_parameter(t1), interpolator.type)
+                segments[i] = segment
+            self.standalone = path_from_segments(segments, coefficients, self.points, self.tangents, self.headings)
+        return self.standalone
+
+    def rebuild_segments(self, points, tangents, headings, first, last, added_segments):
+        raise ValueError('Sub-paths cannot be edited, edit the parent or a materialized copy')
+
+    def extend_segments(self, segments, coefficients):
+        raise ValueError('Sub-paths cannot be edited, edit the parent or a materialized copy')
+
+
+# Path made of already computed segments (shared, not copied) with their
+# (N, 2, 6) coefficients and the len(segments) + 1 waypoints around them
+def path_from_segments(segments, coefficients, points, tangents, headings):
+    path = Path()
+    path.points = list(points)
+    path.tangents = list(tangents)
+    path.headings = list(headings)
+    path.skip_headings = len(path.headings) == 0
+    path.extend_segments(list(segments), coefficients)
+    return path
+
+
+# Rebuilds a Path from its (N, 2, 6) coefficients, the arc length tables of all
+# segments one after the other with their (N + 1,) table_offsets, and
+# (N + 1, 5) waypoints (x, y, tangent, heading, heading interpolator type)
+# The segments keep views of tables, nothing is copied or integrated
+def path_from_arrays(coefficients, tables, table_offsets, waypoints, skip_headings):
+    table_offsets = numpy.asarray(table_offsets).tolist()
+    tables = [tables[start:end] for start, end in zip(table_offsets[:-1], table_offsets[1:])]
+    path = Path()
+    path.points = waypoints[:, :2].tolist()
+    path.tangents = waypoints[:, 2].tolist()
+    path.skip_headings = skip_headings
+    if path.skip_headings:
+        path.headings = []
+    else:
+        path.headings = [(heading, InterpolatorType(int(type))) for heading, type in waypoints[:, 3:].tolist()]
+    path.build_segments(coefficients, tables)
+    return path
+
+
+# Joins paths end to end into a new Path that shares their segments, so
+# nothing is solved or integrated again. Every path must start where the
+# previous one ended, heading the same way (within tolerance and angle_tolerance
+# in radians), and either all or none of them have headings. Views are materialized first
+def concatenate_paths(paths, tolerance=1e-6, angle_tolerance=1e-3):
+    paths = [path.materialize() if isinstance(path, SubPath) else path for path in paths]
+    if len(paths) == 0:
+        raise ValueError('Nothing to concatenate')
+    for previous, path in zip(paths[:-1], paths[1:]):
+        if previous.skip_headings != path.skip_headings:
+            raise ValueError('Either all or none of the concatenated paths must have headings')
+        end = previous.segments[-1].point_at_parameter(1)
+        start = path.segments[0].point_at_parameter(0)
+        if math.hypot(end[0] - start[0], end[1] - start[1]) > tolerance:
+            raise ValueError('Concatenated paths must start where the previous one ends')
+        end_tangent = previous.segments[-1].first_deriv_at_parameter(1)
+        start_tangent = path.segments[0].first_deriv_at_parameter(0)
+        angle = math.atan2(cross(end_tangent, start_tangent), numpy.dot(end_tangent, start_tangent))
+        if abs(angle) > angle_tolerance:
+            raise ValueError('Concatenated paths must continue in the direction the previous one ends')
+
+    segments = [segment for path in paths for segment in path.segments]
+    coefficients = numpy.concatenate([path.coefficients for path in paths])
+    points = paths[0].points + [point for path in paths[1:] for point in path.points[1:]]
+    tangents = paths[0].tangents + [tangent for path in paths[1:] for tangent in path.tangents[1:]]
+    headings = paths[0].headings + [heading for path in paths[1:] for heading in path.headings[1:]]
+    return path_from_segments(segments, coefficients, points, tangents, headings)
+
+
+# Tangent length heuristic from this paper:
+# Lau, Boris & Sprunk, Christoph & Burgard, Wolfram. (2009). Kinodynamic Motion Planning for Mobile Robots Using Splines.
+# Returns the tangent length used by each of the len(points) - 1 segments
+def tangent_lengths(points):
+    distances = numpy.linalg.norm(numpy.diff(numpy.asarray(points, dtype=float), axis=0), axis=1)
+    lengths = numpy.empty(len(distances))
+    lengths[0] = 0.5 * distances[0]
+    if len(distances) > 1:
+        lengths[1:-1] = numpy.minimum(distances[:-2], distances[1:-1])
+        lengths[-1] = 0.5 * distances[-2]
+    return lengths
+
+
+# Values and derivatives at both ends of every segment of a path through points
+# with the tangent angles (in degrees) given at each point. Second derivatives are 0
+# Returns two (N, 6) arrays of xn, xn', xn", xn+1, xn+1', xn+1"
+def segment_derivs(points, tangents):
+    points = numpy.asarray(points, dtype=float)
+    angles = numpy.radians(numpy.asarray(tangents, dtype=float))
+    lengths = tangent_lengths(points)
+    x_derivs = numpy.zeros((len(lengths), 6))
+    y_derivs = numpy.zeros((len(lengths), 6))
+    x_derivs[:, 0], y_derivs[:, 0] = points[:-1, 0], points[:-1, 1]
+    x_derivs[:, 1], y_derivs[:, 1] = lengths * numpy.cos(angles[:-1]), lengths * numpy.sin(angles[:-1])
+    x_derivs[:, 3], y_derivs[:, 3] = points[1:, 0], points[1:, 1]
+    x_derivs[:, 4], y_derivs[:, 4] = lengths * numpy.cos(angles[1:]), lengths * numpy.sin(angles[1:])
+    return x_derivs, y_derivs
+
+
+# Everything known about the path at one displacement
+class PathSample:
+    __slots__ = ('displacement', 'position', 'tangent', 'second_deriv', 'curvature', 'heading')
+
+    def __init__(self, displacement, position, tangent, second_deriv, curvature, heading):
+        self.displacement = displacement
+        self.position = position
+        self.tangent = tangent
+        self.second_deriv = second_deriv
+        self.curvature = curvature
+        self.heading = heading
+
+
+# Closest point on the path to a point: displacement, segment index,
+# parameter within the segment, position and signed lateral error
+# (positive when the point is left of the path)
+class PathProjection:
+    __slots__ = ('displacement', 'segment', 'parameter', 'position', 'lateral_error')
+
+    def __init__(self, displacement, segment, parameter, position, lateral_error):
+        self.displacement = displacement
+        self.segment = segment
+        self.parameter = parameter
+        self.position = position
+        self.lateral_error = lateral_error
+
+
+# Batch sample holding the samples start to stop - 1 of a batch sample
+def slice_samples(sample, start, stop):
+    return PathSample(*[getattr(sample, field)[start:stop] for field in PathSample.__slots__])
+
+
+# Joins batch samples (from samples_at_displacements) in order
+def concatenate_samples(samples):
+    return PathSample(*[numpy.concatenate([getattr(sample, field) for sample in samples])
+                        for field in PathSample.__slots__])
+
 
 def dist(A, B):
     a = numpy.array(A)
@@ -0,0 +1,154 @@
+import gc
+import math
+import struct
+import numpy
+from core.path import *
+
+# segments, arc length table entries, flags, reserved
+# followed by the segments + 1 table offsets as little endian uint64
+path_array_header = struct.Struct('<4I')
+
+path_array_flag_skip_headings = 1
+
+
+# Shapes of the sections of a PathArray, in buffer order
+# table_entries is the total length of the arc length tables of all segments
+def path_array_sections(num_segments, table_entries):
+    return [('coefficients', (num_segments, 2, 6)),
+            ('first_deriv', (num_segments, 2, 6)),
+            ('second_deriv', (num_segments, 2, 6)),
+            # the tables of all segments one after the other, see table_offsets
+            ('arc_length_tables', (table_entries,)),
+            ('cumulative_lengths', (num_segments + 1,)),
+            # start heading (rad), end heading (rad), InterpolatorType value
+            ('headings', (num_segments, 3)),
+            # x, y, tangent (deg), heading (deg), heading interpolator type
+            ('waypoints', (num_segments + 1, 5))]
+
+
+# Everything a Path computes, as arrays of one contiguous float64 buffer
+# instead of Segment, QuinticPolynomial and HeadingInterpolator objects.
+# Coefficients are highest degree first, like Path.coefficients.
+# Every segment keeps its own arc length table resolution: the table of
+# segment i is arc_length_tables[table_offsets[i]:table_offsets[i + 1]].
+# to_bytes, the shared memory methods and pickling all move the buffer as is,
+# and to_path rebuilds a Path from it without integrating anything
+class PathArray:
+    def __init__(self, data, table_offsets, skip_headings, owner=None):
+        self.data = data
+        self.table_offsets = table_offsets
+        self.num_segments = len(table_offsets) - 1
+        self.table_entries = int(table_offsets[-1])
+        self.skip_headings = skip_headings
+        # Whatever holds the memory of data (like a SharedMemory block), kept alive with it
+        self.owner = owner
+        offset = 0
+        for name, shape in path_array_sections(self.num_segments, self.table_entries):
+            size = math.prod(shape)
+            setattr(self, name, data[offset:offset + size].reshape(shape))
+            offset += size
+
+    @property
+    def length(self):
+        return float(self.cumulative_lengths[-1])
+
+    def __len__(self):
+        return self.num_segments
+
+    @staticmethod
+    def size(num_segments, table_entries):
+        return sum(math.prod(shape) for _, shape in path_array_sections(num_segments, table_entries))
+
+    @staticmethod
+    def from_path(path):
+        if isinstance(path, SubPath):
+            path = path.materialize()
+        tables = [segment.arc_length_table for segment in path.segments]
+        table_offsets = numpy.zeros(len(tables) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(table) for table in tables], out=table_offsets[1:])
+
+        array = PathArray(numpy.empty(PathArray.size(len(tables), int(table_offsets[-1]))),
+                          table_offsets, path.skip_headings)
+        array.coefficients[:] = path.coefficients
+        array.first_deriv[:] = derivative_coefficients(array.coefficients)
+        array.second_deriv[:] = derivative_coefficients(array.first_deriv)
+        array.arc_length_tables[:] = numpy.concatenate(tables)
+        array.cumulative_lengths[:] = path.cumulative_lengths
+        array.headings[:] = [[segment.heading_interpolator.start_angle_rad, segment.heading_interpolator.end_angle_rad,
+                              segment.heading_interpolator.type.value] for segment in path.segments]
+        array.waypoints[:] = 0
+        array.waypoints[:, :2] = path.points
+        array.waypoints[:, 2] = path.tangents
+        if not path.skip_headings:
+            array.waypoints[:, 3] = [heading[0] for heading in path.headings]
+            array.waypoints[:, 4] = [heading[1].value for heading in path.headings]
+        return array
+
+    # A Path whose coefficients and arc length tables are views of this array
+    def to_path(self):
+        return path_from_arrays(self.coefficients, self.arc_length_tables, self.table_offsets, self.waypoints,
+                                self.skip_headings)
+
+    def to_bytes(self):
+        flags = path_array_flag_skip_headings if self.skip_headings else 0
+        return path_array_header.pack(self.num_segments, self.table_entries, flags, 0) + \
+            numpy.asarray(self.table_offsets, dtype='<u8').tobytes() + \
+            numpy.ascontiguousarray(self.data, dtype='<f8').tobytes()
+
+    # PathArray viewing buffer (bytes, memoryview, mmap...) written by to_bytes, without copying
+    @staticmethod
+    def from_bytes(buffer, owner=None):
+        if len(buffer) < path_array_header.size:
+            raise ValueError('Not a PathArray buffer')
+        num_segments, table_entries, flags, _ = path_array_header.unpack_from(buffer)
+        size = PathArray.size(num_segments, table_entries)
+        data_offset = path_array_header.size + 8 * (num_segments + 1)
+        if len(buffer) < data_offset + 8 * size:
+            raise ValueError('PathArray buffer is too small')
+        table_offsets = numpy.frombuffer(buffer, dtype='<u8', count=num_segments + 1,
+                                         offset=path_array_header.size).astype(numpy.int64)
+        check_table_offsets(table_offsets, table_entries)
+        data = numpy.frombuffer(buffer, dtype='<f8', count=size, offset=data_offset)
+        return PathArray(data, table_offsets, bool(flags & path_array_flag_skip_headings), owner)
+
+    # Copies the array into a new shared memory block and returns the SharedMemory.
+    # Other processes open it with from_shared_memory(block.name). The creator
+    # has to close and unlink the block once nobody needs it anymore
+    def to_shared_memory(self):
+        from multiprocessing import shared_memory
+        payload = self.to_bytes()
+        block = shared_memory.SharedMemory(create=True, size=len(payload))
+        block.buf[:len(payload)] = payload
+        return block
+
+    # PathArray reading straight from the shared memory block called name
+    # The block stays open for as long as the array (or a Path made from it) is alive
+    @staticmethod
+    def from_shared_memory(name):
+        from multiprocessing import shared_memory
+        block = shared_memory.SharedMemory(name=name)
+        return PathArray.from_bytes(block.buf, block)
+
+    # Unmaps the shared memory block of an array from from_shared_memory.
+    # Paths made from it with to_path must be gone first
+    def close(self):
+        for name, _ in path_array_sections(self.num_segments, self.table_entries):
+            setattr(self, name, None)
+        self.data = None
+        if self.owner is not None:
+            # Segments and their heading interpolators reference each other,
+            # so dropped paths only let go of the buffer once collected
+            gc.collect()
+            self.owner.close()
+            self.owner = None
+
+    # Pickles as the raw buffer instead of the arrays one by one
+    def __reduce__(self):
+        return PathArray.from_bytes, (self.to_bytes(),)
+
+
+# Makes sure (segments + 1,) table offsets read from a buffer split table_entries
+# values into tables of at least two entries, one per segment
+def check_table_offsets(table_offsets, table_entries):
+    if table_offsets[0] != 0 or table_offsets[-1] != table_entries or numpy.any(numpy.diff(table_offsets) < 2):
+        raise ValueError('Invalid arc length table offsets')
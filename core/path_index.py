@@ -0,0 +1,150 @@
+import math
+import numpy
+from core.segment import *
+
+# Newton iterations used to refine a projection onto the spline
+max_projection_iterations = 12
+projection_tolerance = 1e-12
+# Largest parameter step of a single Newton iteration, keeps it from jumping across the path
+max_projection_step = 0.25
+# Rings of grid cells searched around a point before falling back to every sample
+max_grid_rings = 4
+
+
+# Uniform grid over points sampled along the segments of a path, used to
+# find the closest point on the path to any point.
+# Parameters are global: u = segment index + segment parameter, in [0, segments]
+class PathIndex:
+    def __init__(self, coefficients, samples_per_segment=16):
+        self.coefficients = numpy.asarray(coefficients, dtype=float)
+        self.first_deriv = derivative_coefficients(self.coefficients)
+        self.second_deriv = derivative_coefficients(self.first_deriv)
+        num_segments = len(self.coefficients)
+
+        self.params = numpy.append((numpy.arange(num_segments)[:, None] +
+                                    numpy.linspace(0, 1, samples_per_segment, endpoint=False)).ravel(), num_segments)
+        self.points = self.evaluate(self.coefficients, self.params)
+        # Every point of the path is within half the largest chord of a sample
+        chords = numpy.linalg.norm(numpy.diff(self.points, axis=0), axis=1)
+        self.spacing = max(float(chords.max()), 1e-9)
+
+        # Grid cells as sorted integer keys:
+        # the samples of cell_keys[i] are cell_order[cell_starts[i]:cell_ends[i]]
+        self.cell_size = self.spacing
+        self.origin = self.points.min(axis=0)
+        cells = numpy.floor((self.points - self.origin) / self.cell_size).astype(int)
+        self.grid_shape = cells.max(axis=0) + 1
+        keys = self.__cell_keys(cells)
+        self.cell_order = numpy.argsort(keys, kind='stable')
+        self.cell_keys, self.cell_starts = numpy.unique(keys[self.cell_order], return_index=True)
+        self.cell_ends = numpy.append(self.cell_starts[1:], len(keys))
+
+    # Global parameters of the samples that may be closest to point:
+    # every sample within half a sample spacing of the closest sample's distance
+    def candidates(self, point):
+        return self.candidates_many(numpy.asarray(point, dtype=float).reshape(1, 2))[1]
+
+    # candidates for many points at once (done in chunks to bound memory).
+    # Every point searches all cells within max_grid_rings of its own,
+    # points too far from the path for that fall back to every sample.
+    # Returns (indices into points, global parameters) of all candidates
+    def candidates_many(self, points, chunk_size=1024):
+        rings = numpy.arange(-max_grid_rings, max_grid_rings + 1)
+        neighbours = numpy.stack(numpy.meshgrid(rings, rings, indexing='ij'), axis=-1).reshape(-1, 2)
+        indices = []
+        params = []
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            cells = numpy.floor((chunk - self.origin) / self.cell_size).astype(int)
+            keys = self.__cell_keys(cells[:, None, :] + neighbours[None, :, :]).ravel()
+            slots = numpy.minimum(numpy.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+            found = self.cell_keys[slots] == keys
+            starts = numpy.where(found, self.cell_starts[slots], 0)
+            counts = numpy.where(found, self.cell_ends[slots] - starts, 0)
+
+            # One (point, sample) pair for every sample of the searched cells, grouped by point
+            per_point = counts.reshape(len(chunk), -1).sum(axis=1)
+            rows = numpy.repeat(numpy.arange(len(chunk)), per_point)
+            firsts = numpy.cumsum(counts) - counts
+            samples = self.cell_order[numpy.arange(len(rows)) + numpy.repeat(starts - firsts, counts)]
+            distances = numpy.hypot(chunk[rows, 0] - self.points[samples, 0], chunk[rows, 1] - self.points[samples, 1])
+
+            best = numpy.full(len(chunk), math.inf)
+            searched = per_point > 0
+            if len(rows) > 0:
+                best[searched] = numpy.minimum.reduceat(distances, (numpy.cumsum(per_point) - per_point)[searched])
+            # Every sample within limit of a point is at most ceil(limit / cell_size) cells away
+            limit = best + 0.5 * self.spacing
+            complete = numpy.ceil(limit / self.cell_size) <= max_grid_rings
+            keep = complete[rows] & (distances <= limit[rows])
+            indices.append(rows[keep] + start)
+            params.append(self.params[samples[keep]])
+
+            far = numpy.nonzero(~complete)[0]
+            if len(far) > 0:
+                distances = numpy.hypot(chunk[far, None, 0] - self.points[None, :, 0], chunk[far, None, 1] - self.points[None, :, 1])
+                far_rows, columns = numpy.nonzero(distances <= distances.min(axis=1)[:, None] + 0.5 * self.spacing)
+                indices.append(far[far_rows] + start)
+                params.append(self.params[columns])
+        return numpy.concatenate(indices), numpy.concatenate(params)
+
+    # Integer keys of (..., 2) grid cells, cells off the grid all
+    # get the key of an empty cell just outside it
+    def __cell_keys(self, cells):
+        x = numpy.clip(cells[..., 0], -1, self.grid_shape[0]) + 1
+        y = numpy.clip(cells[..., 1], -1, self.grid_shape[1]) + 1
+        return x * (self.grid_shape[1] + 2) + y
+
+    # Newton's method on (r(u) - point) . r'(u) = 0 for every start parameter,
+    # crossing into neighbouring segments where needed
+    # points: (N, 2), params: (N,) start parameters. Returns the refined parameters
+    def refine(self, points, params):
+        params = numpy.array(params, dtype=float)
+        num_segments = len(self.coefficients)
+        for iteration in range(max_projection_iterations):
+            offset = self.evaluate(self.coefficients, params) - points
+            rt1 = self.evaluate(self.first_deriv, params)
+            rt2 = self.evaluate(self.second_deriv, params)
+            gradient = numpy.einsum('ij,ij->i', offset, rt1)
+            hessian = numpy.einsum('ij,ij->i', rt1, rt1) + numpy.einsum('ij,ij->i', offset, rt2)
+            # Away from a minimum, step downhill instead
+            step = numpy.where(hessian > 0, -gradient / numpy.where(hessian > 0, hessian, 1), -numpy.sign(gradient))
+            step = numpy.clip(step, -max_projection_step, max_projection_step)
+            new_params = numpy.clip(params + step, 0, num_segments)
+            converged = numpy.max(numpy.abs(new_params - params), initial=0) < projection_tolerance
+            params = new_params
+            if converged:
+                break
+        if instrumentation.collector is not None:
+            instrumentation.collector.count('projection_iterations', (iteration + 1) * len(params))
+        return params
+
+    # Closest of the candidates (indices into points, global parameters) of each point
+    # Returns (N,) global parameters
+    def closest(self, points, indices, params):
+        params = self.refine(points[indices], params)
+        distances = numpy.hypot(*(self.evaluate(self.coefficients, params) - points[indices]).T)
+        # Sort by point, then distance, and keep the first of each point
+        order = numpy.lexsort((distances, indices))
+        first = numpy.ones(len(order), dtype=bool)
+        first[1:] = indices[order][1:] != indices[order][:-1]
+        result = numpy.empty(len(points))
+        result[indices[order][first]] = params[order][first]
+        return result
+
+    # Evaluates (N, 2, 6) coefficients at global parameters, returns (len(params), 2)
+    @staticmethod
+    def evaluate(coefficients, params):
+        segment_ids, t = split_parameters(params, len(coefficients))
+        coeffs = coefficients[segment_ids]
+        result = coeffs[..., 0]
+        for k in range(1, 6):
+            result = result * t[:, None] + coeffs[..., k]
+        return result
+
+
+# Splits global parameters into segment indices and parameters within the segment
+def split_parameters(params, num_segments):
+    params = numpy.asarray(params, dtype=float)
+    segment_ids = numpy.minimum(numpy.floor(params).astype(int), num_segments - 1)
+    return segment_ids, params - segment_ids
@@ -18,8 +18,9 @@ class QuinticPolynomial:
             raise ValueError(
                 "Invalid polynomial coefficients given. Expected either six separate coefficients or an array of six coefficients.")
 
+    # Horner's scheme, works for scalars as well as numpy arrays of parameters
     def eval(self, t):
-        return self.a * t**5 + self.b * t**4 + self.c * t**3 + self.d * t**2 + self.e * t + self.f
+        return ((((self.a * t + self.b) * t + self.c) * t + self.d) * t + self.e) * t + self.f
 
     def first_deriv(self):
         return QuinticPolynomial(0, 5 * self.a, 4 * self.b, 3 * self.c, 2 * self.d, self.e)
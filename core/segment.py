@@ -1,7 +1,7 @@
 from core.quintic_polynomial import *
 import math
-from scipy.integrate import quad
-from scipy import linalg, optimize
+import numpy
+from core.instrumentation import instrumentation
 
 coefficient_matrix = [
     [0, 0, 0, 0, 0, 1],
@@ -11,6 +11,22 @@ coefficient_matrix = [
     [5, 4, 3, 2, 1, 0],
     [20, 12, 6, 2, 0, 0]
 ]
+# The matrix never changes, so it is only inverted once
+coefficient_matrix_inv = numpy.linalg.inv(coefficient_matrix)
+
+# 5 point Gauss-Legendre nodes and weights on [-1, 1] used to integrate
+# the speed of a segment over each interval of its arc length table
+# (closed form, the same as numpy.polynomial.legendre.leggauss(5))
+gauss_nodes = numpy.array([-math.sqrt(5 + 2 * math.sqrt(10 / 7)) / 3, -math.sqrt(5 - 2 * math.sqrt(10 / 7)) / 3, 0,
+                           math.sqrt(5 - 2 * math.sqrt(10 / 7)) / 3, math.sqrt(5 + 2 * math.sqrt(10 / 7)) / 3])
+gauss_weights = numpy.array([(322 - 13 * math.sqrt(70)) / 900, (322 + 13 * math.sqrt(70)) / 900, 128 / 225,
+                             (322 + 13 * math.sqrt(70)) / 900, (322 - 13 * math.sqrt(70)) / 900])
+
+# The arc length table is refined until s(t) stops changing by more than this
+arc_length_tolerance = 1e-9
+max_arc_length_intervals = 4096
+# Most Gauss nodes evaluated at once when building tables
+max_arc_length_nodes = 1 << 16
 
 class Segment:
     def __init__(self):
@@ -25,15 +41,19 @@ class Segment:
         self.length = -1
         self.heading_interpolator = None
 
+        # s(t) sampled at uniformly spaced parameters, built in compute_coeffs
+        self.arc_length_params = None
+        self.arc_length_table = None
+
+        # Computed on first use by curvature_extrema
+        self.curvature_extrema_cache = None
+
     # Generates the points necessary for plotting the segment
     # with given no. of points
     def plot_points(self, resolution):
-        parameter_values = [i / resolution for i in range(resolution+1)]
-        curve_points = [self.point_at_parameter(p) for p in parameter_values]
-
-        x_values = [point[0] for point in curve_points]
-        y_values = [point[1] for point in curve_points]
-        return x_values, y_values
+        parameter_values = numpy.linspace(0, 1, resolution + 1)
+        x_values, y_values = self.point_at_parameter(parameter_values)
+        return x_values.tolist(), y_values.tolist()
 
     def point_at_parameter(self, t):
         return self.xpoly.eval(t), self.ypoly.eval(t)
@@ -56,47 +76,74 @@ class Segment:
     def unit_arc_length(self, tau):
         return math.sqrt(self.xpoly_first_deriv.eval(tau)**2 + self.ypoly_first_deriv.eval(tau)**2)
 
+    # Same as unit_arc_length, but accepts numpy arrays of parameters
+    def speed_at_parameter(self, t):
+        return numpy.hypot(self.xpoly_first_deriv.eval(t), self.ypoly_first_deriv.eval(t))
+
     # Integrate sqrt(dx/dt ^2 + dy/dt^2) from 0 to t
     # to find the arc length
     # Returns s(t)
     def displacement_at_parameter(self, t):
-        len, _ = quad(self.unit_arc_length, 0, t)
-        return len
+        return float(self.displacements_at_parameters(t))
+
+    # Vectorized s(t) for a numpy array of parameters.
+    # The table gives s at the start of the interval containing each t,
+    # the rest is a single Gauss-Legendre rule over the partial interval
+    def displacements_at_parameters(self, t):
+        t = numpy.clip(numpy.asarray(t, dtype=float), 0, 1)
+        if instrumentation.collector is not None:
+            instrumentation.collector.count('arc_length_integrations', t.size)
+        intervals = len(self.arc_length_params) - 1
+        idx = numpy.minimum((t * intervals).astype(int), intervals - 1)
+        t0 = self.arc_length_params[idx]
+        half_width = (t - t0) / 2
+        nodes = t0[..., None] + half_width[..., None] * (gauss_nodes + 1)
+        return self.arc_length_table[idx] + half_width * (self.speed_at_parameter(nodes) @ gauss_weights)
 
     # Calculates at which t in [0,1] we have a particular displacement s0
     # Returns t such that s(t) = s0
-    # Finds the root of the function s(t) - s0 = 0 using Brent's method
     def parameter_at_displacement(self, s0):
-        if not in_range(s0, 0, self.length):
+        return float(self.parameters_at_displacements(s0))
+
+    # Vectorized t(s) for a numpy array of displacements.
+    # The arc length table is interpolated for a first guess which is then
+    # refined with Newton steps, since ds/dt is just the speed
+    def parameters_at_displacements(self, s):
+        s = numpy.asarray(s, dtype=float)
+        if s.size and not (in_range(s.min(), 0, self.length) and in_range(s.max(), 0, self.length)):
             raise ValueError('Incorrect displacement provided')
-        
-        def f(t):
-            return self.displacement_at_parameter(t) - s0
-        # Catch these edge cases before they reach the brentq solver
-        if s0 < 0.01:
-            return 0
-        if self.length - s0 < 0.01:
-            return 1
-        
-        t = optimize.brentq(f, 0, 1)
-        if in_range(t, 0, 1, eps=0.01):
-            return t
-        else:
-            raise ValueError("parameter_at_displacement failed")
-        
-        # _, t = custom_trapezoidal(
-        #     self.unit_arc_length, 0, 1, 1000, s, eps=0.2)
-        # if t == -1:
-        #     # The integration failed, as a last resort try integrating with more steps and higher tolerance
-        #     print('Integration failed, attempting to fix it')
-        #     _, t = custom_trapezoidal(
-        #         self.unit_arc_length, 0, 1, 3000, s, eps=0.2)
-        #     if t == -1:
-        #         print("This should not show. Check parameter_at function")
-        #         return 1
-        #     return t
-        # else:
-        #     return t
+        s = numpy.clip(s, 0, self.length)
+
+        intervals = len(self.arc_length_params) - 1
+        idx = numpy.clip(numpy.searchsorted(self.arc_length_table, s, side='right') - 1, 0, intervals - 1)
+        t_low, t_high = self.arc_length_params[idx], self.arc_length_params[idx + 1]
+        s_low, s_high = self.arc_length_table[idx], self.arc_length_table[idx + 1]
+        ds = s_high - s_low
+        fraction = numpy.divide(s - s_low, ds, out=numpy.zeros_like(s), where=ds > 0)
+        t = t_low + fraction * (t_high - t_low)
+
+        for _ in range(4):
+            error = self.displacements_at_parameters(t) - s
+            if numpy.all(numpy.abs(error) < arc_length_tolerance):
+                break
+            if instrumentation.collector is not None:
+                instrumentation.collector.count('root_find_iterations', s.size)
+            speed = self.speed_at_parameter(t)
+            step = numpy.divide(error, speed, out=numpy.zeros_like(error), where=speed > 0)
+            # Never leave the bracketing interval of the table
+            t = numpy.clip(t - step, t_low, t_high)
+        return t
+
+    # Builds the s(t) table used to invert the arc length
+    def build_arc_length_table(self):
+        coeffs = numpy.array([[self.xpoly.a, self.xpoly.b, self.xpoly.c, self.xpoly.d, self.xpoly.e, self.xpoly.f],
+                              [self.ypoly.a, self.ypoly.b, self.ypoly.c, self.ypoly.d, self.ypoly.e, self.ypoly.f]])
+        self.set_arc_length_table(arc_length_tables(coeffs[None])[0])
+
+    def set_arc_length_table(self, table):
+        self.arc_length_params = numpy.linspace(0, 1, len(table))
+        self.arc_length_table = table
+        self.length = float(table[-1])
 
     # Calculates the coefficients of the polynomials given the
     # values and derivatives
@@ -108,8 +155,12 @@ class Segment:
             raise ValueError(
                 "Invalid coefficients. Expected xn, xn', xn\", xn+1, xn+1', xn+1\" ")
 
-        x_coeffs = linalg.solve(coefficient_matrix, x_derivs)
-        y_coeffs = linalg.solve(coefficient_matrix, y_derivs)
+        self.set_coeffs(coefficient_matrix_inv @ numpy.asarray(x_derivs, dtype=float),
+                        coefficient_matrix_inv @ numpy.asarray(y_derivs, dtype=float))
+
+    # Sets already computed polynomial coefficients (highest degree first)
+    # The arc length table is only built when it is not given
+    def set_coeffs(self, x_coeffs, y_coeffs, arc_length_table=None):
         self.xpoly = QuinticPolynomial(x_coeffs)
         self.ypoly = QuinticPolynomial(y_coeffs)
 
@@ -119,7 +170,131 @@ class Segment:
         self.ypoly_first_deriv = self.ypoly.first_deriv()
         self.ypoly_second_deriv = self.ypoly.second_deriv()
 
-        self.length = self.displacement_at_parameter(1)
+        if arc_length_table is None:
+            self.build_arc_length_table()
+        else:
+            self.set_arc_length_table(arc_length_table)
+        self.curvature_extrema_cache = None
+
+    # Signed curvature at parameter t (scalar or numpy array)
+    def curvature_at_parameter(self, t):
+        xd1, yd1 = self.first_deriv_at_parameter(t)
+        xd2, yd2 = self.second_deriv_at_parameter(t)
+        return (xd1 * yd2 - yd1 * xd2) / numpy.hypot(xd1, yd1) ** 3
+
+    # Parameters in (0, 1) where the curvature has a local extremum, and the curvature there.
+    # With k = c / |r'|^3 and c = x'y'' - y'x'', dk/dt = 0 exactly where the polynomial
+    # c' |r'|^2 - 3 c (x'x'' + y'y'') vanishes, so the extrema are its real roots
+    def curvature_extrema(self):
+        if self.curvature_extrema_cache is None:
+            # Only planning needs this, so it is not imported with the module
+            from numpy.polynomial import polynomial
+            # numpy.polynomial wants the lowest degree first
+            x1 = self.__ascending(self.xpoly_first_deriv)
+            y1 = self.__ascending(self.ypoly_first_deriv)
+            x2 = polynomial.polyder(x1)
+            y2 = polynomial.polyder(y1)
+            cross = polynomial.polysub(polynomial.polymul(x1, y2), polynomial.polymul(y1, x2))
+            speed_squared = polynomial.polyadd(polynomial.polymul(x1, x1), polynomial.polymul(y1, y1))
+            dot = polynomial.polyadd(polynomial.polymul(x1, x2), polynomial.polymul(y1, y2))
+            numerator = polynomial.polysub(polynomial.polymul(polynomial.polyder(cross), speed_squared),
+                                           3 * polynomial.polymul(cross, dot))
+            numerator = polynomial.polytrim(numerator, 1e-12 * max(numpy.max(numpy.abs(numerator)), 1e-300))
+
+            params = numpy.empty(0)
+            if len(numerator) > 1:
+                roots = polynomial.polyroots(numerator)
+                roots = roots[numpy.abs(roots.imag) < 1e-9].real
+                params = numpy.unique(roots[(roots > 0) & (roots < 1)])
+            self.curvature_extrema_cache = (params, self.curvature_at_parameter(params))
+        return self.curvature_extrema_cache
+
+    # Smallest and largest signed curvature on the whole segment
+    def curvature_bounds(self):
+        params, curvatures = self.curvature_extrema()
+        candidates = numpy.concatenate((curvatures, self.curvature_at_parameter(numpy.array([0.0, 1.0]))))
+        return float(candidates.min()), float(candidates.max())
+
+    def __ascending(self, poly):
+        return numpy.array([poly.f, poly.e, poly.d, poly.c, poly.b, poly.a], dtype=float)
+
+
+# Solves for the coefficients of many segments at once
+# x_derivs, y_derivs: (N, 6) arrays of xn, xn', xn", xn+1, xn+1', xn+1"
+# Returns an (N, 2, 6) array of x and y coefficients
+def segment_coefficients(x_derivs, y_derivs):
+    derivs = numpy.stack((x_derivs, y_derivs), axis=1)
+    return derivs @ coefficient_matrix_inv.T
+
+
+# Coefficients of the first derivative of (..., 6) polynomial coefficients
+def derivative_coefficients(coeffs):
+    derivative = numpy.zeros_like(coeffs)
+    derivative[..., 1:] = coeffs[..., :-1] * numpy.arange(5, 0, -1)
+    return derivative
+
+
+# Horner's scheme for (..., 6) coefficients against an array of parameters
+# Returns an array of shape coeffs.shape[:-1] + t.shape
+def eval_coefficients(coeffs, t):
+    t = numpy.asarray(t, dtype=float)
+    expand = (Ellipsis,) + (None,) * t.ndim
+    result = coeffs[..., 0][expand]
+    for k in range(1, 6):
+        result = result * t + coeffs[..., k][expand]
+    return result
+
+
+# Coefficients (..., 6) of p(t0 + (t1 - t0) u) for u in [0, 1], the part of the
+# polynomials p between t0 and t1, from the Taylor expansion of p at t0
+def trim_coefficients(coeffs, t0, t1):
+    scale = t1 - t0
+    trimmed = numpy.empty_like(coeffs)
+    deriv = coeffs
+    for k in range(6):
+        trimmed[..., 5 - k] = eval_coefficients(deriv, t0) * scale ** k / math.factorial(k)
+        deriv = derivative_coefficients(deriv)
+    return trimmed
+
+
+# Builds the s(t) tables of many segments from their (N, 2, 6) coefficients.
+# Every interval is integrated with a fixed order Gauss-Legendre rule and the
+# number of intervals of each table is doubled until that table settles, so
+# a few hard segments do not make every other table finer
+# Returns a list of N arrays of s at uniformly spaced parameters, each its own length
+def arc_length_tables(coefficients, intervals=16):
+    first_deriv = derivative_coefficients(coefficients)
+    coarse = cumulative_arc_length(first_deriv, intervals)
+    tables = list(coarse)
+    active = numpy.arange(len(first_deriv))
+    while intervals < max_arc_length_intervals and len(active) > 0:
+        intervals *= 2
+        finer = cumulative_arc_length(first_deriv[active], intervals)
+        for i, table in zip(active.tolist(), finer):
+            tables[i] = table
+        unsettled = numpy.max(numpy.abs(finer[:, ::2] - coarse), axis=1) >= arc_length_tolerance
+        active = active[unsettled]
+        coarse = finer[unsettled]
+    return tables
+
+
+# Returns s(t) at intervals + 1 uniformly spaced parameters for every segment
+# Segments are evaluated a chunk at a time to bound the size of the node arrays
+def cumulative_arc_length(first_deriv, intervals):
+    if instrumentation.collector is not None:
+        instrumentation.collector.count('arc_length_integrations', len(first_deriv) * intervals)
+    edges = numpy.linspace(0, 1, intervals + 1)
+    half_width = 0.5 / intervals
+    midpoints = (edges[:-1] + edges[1:]) / 2
+    nodes = midpoints[:, None] + half_width * gauss_nodes[None, :]
+    table = numpy.zeros((len(first_deriv), intervals + 1))
+    chunk_size = max(1, max_arc_length_nodes // nodes.size)
+    for start in range(0, len(first_deriv), chunk_size):
+        derivs = eval_coefficients(first_deriv[start:start + chunk_size], nodes)
+        speeds = numpy.hypot(derivs[:, 0], derivs[:, 1])
+        interval_lengths = half_width * (speeds @ gauss_weights)
+        numpy.cumsum(interval_lengths, axis=1, out=table[start:start + chunk_size, 1:])
+    return table
 
 # Custom integration for stopping
 # Not ideal because its a poor algorithm
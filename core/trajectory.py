@@ -0,0 +1,144 @@
+import numpy
+from core.follower import SetpointStream
+
+# Rows of the trajectory data array
+trajectory_fields = ('t', 's', 'v', 'a', 'vx', 'vy', 'ax', 'ay', 'heading', 'x', 'y')
+
+
+# A time parametrized trajectory stored column-wise.
+# Every field is a row view into a single contiguous (11, N) array:
+# t: time, s: displacement along the path, v/a: velocity and acceleration
+# along the path, vx/vy/ax/ay: their x and y components, heading: in radians,
+# x/y: the position on the path
+# The acceleration is constant between samples: a[i] is the acceleration
+# from t[i-1] to t[i] (a[0] is the start acceleration), which makes the
+# trajectory piecewise analytic and state_at exact at any time
+class Trajectory:
+    def __init__(self, data):
+        data = numpy.asarray(data, dtype=float)
+        if data.ndim != 2 or data.shape[0] != len(trajectory_fields):
+            raise ValueError('Trajectory data must have shape (11, N)')
+        self.data = data
+
+    @property
+    def t(self):
+        return self.data[0]
+
+    @property
+    def s(self):
+        return self.data[1]
+
+    @property
+    def v(self):
+        return self.data[2]
+
+    @property
+    def a(self):
+        return self.data[3]
+
+    @property
+    def vx(self):
+        return self.data[4]
+
+    @property
+    def vy(self):
+        return self.data[5]
+
+    @property
+    def ax(self):
+        return self.data[6]
+
+    @property
+    def ay(self):
+        return self.data[7]
+
+    @property
+    def heading(self):
+        return self.data[8]
+
+    @property
+    def x(self):
+        return self.data[9]
+
+    @property
+    def y(self):
+        return self.data[10]
+
+    @property
+    def duration(self):
+        if len(self) == 0:
+            return 0
+        return float(self.t[-1] - self.t[0])
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    # Integer indices give the state along the path at that sample,
+    # slices give a Trajectory that shares memory with this one
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Trajectory(self.data[:, key])
+        return KinematicState(self.s[key], self.v[key], self.a[key])
+
+    # Exact state along the path at time t, found with a binary search
+    # Times outside the trajectory are clamped to its ends
+    def state_at(self, t):
+        s, v, a = self.states_at(numpy.array([t], dtype=float))
+        return KinematicState(float(s[0]), float(v[0]), float(a[0]))
+
+    # Vectorized state_at, returns arrays of displacement, velocity and acceleration
+    def states_at(self, times):
+        times = numpy.clip(numpy.asarray(times, dtype=float), self.t[0], self.t[-1])
+        if len(self) == 1:
+            return numpy.full(times.shape, self.s[0]), numpy.full(times.shape, self.v[0]), numpy.full(times.shape, self.a[0])
+        i = numpy.clip(numpy.searchsorted(self.t, times, side='left'), 1, len(self) - 1)
+        dt = times - self.t[i - 1]
+        a = self.a[i]
+        return self.s[i - 1] + (self.v[i - 1] + 0.5 * a * dt) * dt, self.v[i - 1] + a * dt, a
+
+    # All the setpoints of a SetpointStream at once, as a Trajectory with one
+    # sample every period seconds (the last one at the end of this trajectory).
+    # The acceleration of every sample is the one it is in, not the one before it
+    def sampled(self, period):
+        if period <= 0:
+            raise ValueError('The sampling period must be positive')
+        if len(self) < 2:
+            raise ValueError('A trajectory needs at least two samples to be resampled')
+        times = self.t[0] + numpy.arange(int(numpy.ceil(self.duration / period)) + 1) * period
+        times = numpy.append(times[times < self.t[-1]], self.t[-1])
+
+        i = numpy.clip(numpy.searchsorted(self.t, times, side='left'), 1, len(self) - 1)
+        s, v, a = self.states_at(times)
+        span = self.t[i] - self.t[i - 1]
+        time_fraction = numpy.divide(times - self.t[i - 1], span, out=numpy.ones_like(times), where=span > 0)
+        ds = self.s[i] - self.s[i - 1]
+        disp_fraction = numpy.divide(s - self.s[i - 1], ds, out=numpy.ones_like(times), where=ds > 0)
+
+        data = numpy.empty((len(trajectory_fields), len(times)))
+        data[0], data[1], data[2], data[3] = times, s, v, a
+        for row, fraction in ((4, time_fraction), (5, time_fraction), (8, disp_fraction), (9, disp_fraction), (10, disp_fraction)):
+            data[row] = self.data[row, i - 1] + fraction * (self.data[row, i] - self.data[row, i - 1])
+        data[6], data[7] = self.ax[i], self.ay[i]
+        return Trajectory(data)
+
+    # Setpoints every period seconds for a follower, see SetpointStream
+    def setpoints(self, period, realtime=False):
+        return SetpointStream(self, period, realtime)
+
+    # State of the x component at sample i
+    def state_x(self, i):
+        return KinematicState(self.s[i], self.vx[i], self.ax[i])
+
+    # State of the y component at sample i
+    def state_y(self, i):
+        return KinematicState(self.s[i], self.vy[i], self.ay[i])
+
+
+class KinematicState:
+    __slots__ = ('position', 'velocity', 'acceleration', 'jerk')
+
+    def __init__(self, position, velocity, acceleration=0, jerk=0):
+        self.position = position
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.jerk = jerk
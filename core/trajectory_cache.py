@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from core.trajectory_file import *
+
+
+# Stable hash of everything that determines a planned trajectory
+def trajectory_key(points, tangents, headings, max_vel, max_acc, max_ang_vel, max_ang_acc,
+                   num_points, start_vel, end_vel):
+    spec = {
+        'version': trajectory_file_version,
+        'points': [[float(x), float(y)] for x, y in points],
+        'tangents': [float(tangent) for tangent in tangents],
+        'headings': [[float(heading), type.name] for heading, type in headings],
+        'constraints': [float(max_vel), float(max_acc), float(max_ang_vel), float(max_ang_acc)],
+        'num_points': int(num_points),
+        'boundary': [float(start_vel), float(end_vel)],
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+# Two tier cache of planned motion profiles, keyed by trajectory_key.
+# The memory tier keeps up to max_entries profiles, the optional disk tier
+# keeps compiled trajectory files in directory up to max_disk_bytes.
+# Both evict the least recently used entries first.
+# Cached profiles are shared between callers and must not be modified
+class TrajectoryCache:
+    def __init__(self, directory=None, max_entries=32, max_disk_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    # Returns the motion profile for the waypoints of a PathBuilder and the
+    # given constraints, only planning it when no tier has it yet
+    def plan(self, path_builder, max_vel, max_acc, max_ang_vel, max_ang_acc, start_vel, end_vel, num_points):
+        key = trajectory_key(path_builder.points, path_builder.tangent_angles, path_builder.headings,
+                             max_vel, max_acc, max_ang_vel, max_ang_acc, num_points, start_vel, end_vel)
+        motion_profile = self.get(key)
+        if motion_profile is None:
+            # The path keeps the waypoint lists, copy them so later edits
+            # of the builder do not reach the cached profile
+            path = Path()
+            path.make_path([list(point) for point in path_builder.points], list(path_builder.tangent_angles),
+                           list(path_builder.headings))
+            motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
+            motion_profile.make_profile(start_vel, end_vel, num_points)
+            self.put(key, motion_profile)
+        return motion_profile
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.memory_hits += 1
+            return self.entries[key]
+
+        filename = self.__filename(key)
+        if filename is not None and os.path.exists(filename):
+            try:
+                motion_profile = load_trajectory(filename)
+            except ValueError:
+                # Written by another version or corrupted, plan it again
+                os.remove(filename)
+            else:
+                os.utime(filename)
+                self.disk_hits += 1
+                self.__remember(key, motion_profile)
+                return motion_profile
+
+        self.misses += 1
+        return None
+
+    def put(self, key, motion_profile):
+        self.__remember(key, motion_profile)
+        filename = self.__filename(key)
+        if filename is not None:
+            # Write next to the final file and rename so readers never see a partial file
+            temp_filename = filename + '.tmp'
+            compile_trajectory(temp_filename, motion_profile)
+            os.replace(temp_filename, filename)
+            self.__evict_disk()
+
+    def clear(self):
+        self.entries.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.traj'):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_evictions': self.memory_evictions,
+            'disk_evictions': self.disk_evictions,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0,
+            'memory_entries': len(self.entries),
+        }
+
+    def __remember(self, key, motion_profile):
+        self.entries[key] = motion_profile
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.memory_evictions += 1
+
+    def __filename(self, key):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + '.traj')
+
+    # Removes the least recently used files until the directory fits in max_disk_bytes
+    def __evict_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.traj'):
+                stat = os.stat(os.path.join(self.directory, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        files.sort()
+        total_size = sum(size for _, size, _ in files)
+        for _, size, name in files:
+            if total_size <= self.max_disk_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_size -= size
+            self.disk_evictions += 1
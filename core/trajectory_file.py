@@ -0,0 +1,103 @@
+import struct
+import zlib
+import numpy
+from core.motion_profile import *
+from core.path_array import *
+
+# Compiled trajectory files store everything needed to follow a planned
+# trajectory so it does not have to be planned again at startup.
+#
+# Layout: a fixed header, the (segments + 1) little endian uint64 offsets
+# of the arc length table of every segment, then little endian float64 sections
+#   coefficients          (segments, 2, 6)
+#   arc length tables     (table entries,): the tables of all segments one
+#                         after the other, table i is [offsets[i], offsets[i + 1])
+#   waypoints             (segments + 1, 5): x, y, tangent (deg), heading (deg), heading interpolator type
+#   trajectory            (11, samples), rows as in trajectory_fields
+#   displacement profile  (samples, 2)
+# The checksum is the CRC-32 of everything after the fixed header
+trajectory_file_magic = b'PPTRAJ\x00\x00'
+trajectory_file_version = 3
+
+# magic, version, flags, segments, table entries, samples, checksum, 2 reserved,
+# max_vel, max_acc, max_ang_vel, max_ang_acc
+header_format = '<8s8I4d'
+header_size = struct.calcsize(header_format)
+
+flag_skip_headings = 1
+
+
+# Writes the path and the trajectory of a motion profile
+# (make_profile must have been called) to filename
+def compile_trajectory(filename, motion_profile):
+    table_offsets, *sections = motion_profile_arrays(motion_profile)
+    payload = numpy.asarray(table_offsets, dtype='<u8').tobytes() + \
+        b''.join(numpy.ascontiguousarray(section, dtype='<f8').tobytes() for section in sections)
+    flags = flag_skip_headings if motion_profile.path.skip_headings else 0
+    header = struct.pack(header_format, trajectory_file_magic, trajectory_file_version, flags,
+                         len(table_offsets) - 1, int(table_offsets[-1]), len(motion_profile.trajectory),
+                         zlib.crc32(payload), 0, 0,
+                         motion_profile.max_vel, motion_profile.max_acc,
+                         motion_profile.max_ang_vel, motion_profile.max_ang_acc)
+    with open(filename, 'wb') as file:
+        file.write(header)
+        file.write(payload)
+
+
+# Memory maps a compiled trajectory file and returns a MotionProfile
+# whose path and trajectory read directly from the mapped file.
+# Stale or corrupted files are rejected with a ValueError
+def load_trajectory(filename):
+    mapped = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+    if len(mapped) < header_size:
+        raise ValueError('Not a compiled trajectory file')
+    (magic, version, flags, num_segments, table_entries, num_samples, checksum, _, _,
+     max_vel, max_acc, max_ang_vel, max_ang_acc) = struct.unpack_from(header_format, mapped)
+    if magic != trajectory_file_magic:
+        raise ValueError('Not a compiled trajectory file')
+    if version != trajectory_file_version:
+        raise ValueError('Unsupported compiled trajectory version {0} (expected {1})'.format(version, trajectory_file_version))
+
+    shapes = [(num_segments, 2, 6), (table_entries,), (num_segments + 1, 5),
+              (len(trajectory_fields), num_samples), (num_samples, 2)]
+    payload_size = 8 * (num_segments + 1) + 8 * sum(int(numpy.prod(shape)) for shape in shapes)
+    if len(mapped) != header_size + payload_size:
+        raise ValueError('Compiled trajectory file has the wrong size')
+    if zlib.crc32(mapped[header_size:]) != checksum:
+        raise ValueError('Compiled trajectory checksum mismatch')
+
+    offset = header_size + 8 * (num_segments + 1)
+    table_offsets = mapped[header_size:offset].view('<u8').astype(numpy.int64)
+    check_table_offsets(table_offsets, table_entries)
+    sections = [table_offsets]
+    for shape in shapes:
+        size = 8 * int(numpy.prod(shape))
+        sections.append(mapped[offset:offset + size].view('<f8').reshape(shape))
+        offset += size
+    return motion_profile_from_arrays(sections, bool(flags & flag_skip_headings),
+                                      (max_vel, max_acc, max_ang_vel, max_ang_acc))
+
+
+# The sections of a made motion profile as plain arrays, in file order:
+# table offsets, coefficients, arc length tables, waypoints, trajectory data,
+# displacement profile
+def motion_profile_arrays(motion_profile):
+    if motion_profile.trajectory is None:
+        raise ValueError('The motion profile must be made before it can be compiled')
+
+    path_array = PathArray.from_path(motion_profile.path)
+    return (path_array.table_offsets, path_array.coefficients, path_array.arc_length_tables, path_array.waypoints,
+            motion_profile.trajectory.data, numpy.asarray(motion_profile.displacement_profile, dtype=float))
+
+
+# Rebuilds a MotionProfile from the sections returned by motion_profile_arrays
+# without integrating anything. constraints: max_vel, max_acc, max_ang_vel, max_ang_acc
+def motion_profile_from_arrays(sections, skip_headings, constraints):
+    table_offsets, coefficients, tables, waypoints, data, displacement_profile = sections
+    path = path_from_arrays(coefficients, tables, table_offsets, waypoints, skip_headings)
+
+    motion_profile = MotionProfile(path, *constraints)
+    motion_profile.trajectory = Trajectory(data)
+    motion_profile.displacement_profile = displacement_profile
+    motion_profile.duration = motion_profile.trajectory.duration
+    return motion_profile
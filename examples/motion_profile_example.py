@@ -35,10 +35,8 @@ path = path_builder.build()
 path_points = path_builder.points
 
 motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
-time_profile_x, time_profile_y = motion_profile.make_profile(start_vel=0, end_vel=0, num_points=200)
-time_profile_abs = motion_profile.time_profile_abs
+trajectory = motion_profile.make_profile(start_vel=0, end_vel=0, num_points=200)
 displacement_profile = motion_profile.displacement_profile
-heading_profile = motion_profile.heading_profile
 
 print('Trajectory generated in {0:3.2f} seconds'.format(time.perf_counter() - start_time))
 print('Trajectory duration: {0:3.2f} seconds'.format(motion_profile.duration))
@@ -68,22 +66,16 @@ axis[0][1].set_ylabel('velocity (in/s)')
 axis[0][1].grid()
 
 # ----- TIME PROFILE (absolute value) -----
-t = [point[0] for point in time_profile_abs]
-velocities = [point[1].velocity for point in time_profile_abs]
-accelerations = [point[1].acceleration for point in time_profile_abs]
-axis[0][2].plot(t, velocities, color='green')
-axis[0][2].plot(t, accelerations, color='orange')
+axis[0][2].plot(trajectory.t, trajectory.v, color='green')
+axis[0][2].plot(trajectory.t, trajectory.a, color='orange')
 axis[0][2].set_title('Time profile (absolute value)')
 axis[0][2].set_xlabel('time (s)')
 axis[0][2].legend(['velocity (in/s)', 'acceleration (in/s^2)'])
 axis[0][2].grid()
 
 # ----- VELOCITY TIME PROFILE (per component) -----
-t = [point[0] for point in time_profile_x]
-velocities_x = [point[1].velocity for point in time_profile_x]
-velocities_y = [point[1].velocity for point in time_profile_y]
-axis[1][0].plot(t, velocities_x, color='blue')
-axis[1][0].plot(t, velocities_y, color='red')
+axis[1][0].plot(trajectory.t, trajectory.vx, color='blue')
+axis[1][0].plot(trajectory.t, trajectory.vy, color='red')
 axis[1][0].set_title('Velocity profile (component-wise)')
 axis[1][0].grid()
 axis[1][0].legend(['ẋ', 'ẏ'])
@@ -91,10 +83,8 @@ axis[1][0].set_xlabel('time (s)')
 axis[1][0].set_ylabel('velocity (in/s)')
 
 # ----- ACCELERATION TIME PROFILE (per component) -----
-acc_x = [point[1].acceleration for point in time_profile_x]
-acc_y = [point[1].acceleration for point in time_profile_y]
-axis[1][1].plot(t, acc_x, color='blue')
-axis[1][1].plot(t, acc_y, color='red')
+axis[1][1].plot(trajectory.t, trajectory.ax, color='blue')
+axis[1][1].plot(trajectory.t, trajectory.ay, color='red')
 axis[1][1].set_title('Acceleration profile (component-wise)')
 axis[1][1].grid()
 axis[1][1].legend(['ẍ', 'ÿ'])
@@ -102,7 +92,6 @@ axis[1][1].set_xlabel('time (s)')
 axis[1][1].set_ylabel('acceleration (in/s^2)')
 
 # ----- HEADING-----
-heading = [math.degrees(h[1]) for h in heading_profile]
-axis[1][2].plot(t, heading)
+axis[1][2].plot(trajectory.t, numpy.degrees(trajectory.heading))
 axis[1][2].set_title('Heading (deg)')
 plt.show()
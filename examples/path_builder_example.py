@@ -23,11 +23,8 @@ max_ang_vel = 3.14
 max_ang_acc = 3.14
 
 motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
-motion_profile.make_profile(start_vel=0, end_vel=0, num_points=200)
-time_profile_abs = motion_profile.time_profile_abs
-t = [point[0] for point in time_profile_abs]
-velocities = [point[1].velocity for point in time_profile_abs]
-axis[1].plot(t, velocities, color='green')
+trajectory = motion_profile.make_profile(start_vel=0, end_vel=0, num_points=200)
+axis[1].plot(trajectory.t, trajectory.v, color='green')
 axis[1].set_title('Time profile (absolute value)')
 axis[1].set_xlabel('time (s)')
 axis[1].legend(['velocity (in/s)'])
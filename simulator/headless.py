@@ -0,0 +1,205 @@
+import sys
+import json
+import time
+import argparse
+import numpy
+
+from core.path import *
+from core.motion_profile import *
+
+# Basic constraints, the same as the pygame simulator
+max_vel = 30
+max_acc = 40
+max_ang_vel = 3.14
+max_ang_acc = 3.14
+
+
+# The routine shown by the pygame simulator
+def example_path_builder():
+    path_builder = PathBuilder([36, -63.0], start_heading_deg=-10)
+    path_builder.point_linear_heading([30.0, -23], tangent_angle_deg=120, heading_deg=120)
+    path_builder.point_linear_heading([27, 0.5], tangent_angle_deg=45, heading_deg=45)
+    path_builder.point_constant_heading([45, -10.5], tangent_angle_deg=0)
+    path_builder.point_constant_heading([58.6, -9.5], tangent_angle_deg=15)
+    return path_builder
+
+
+# Follows many motion profiles at once without a display or the wall clock.
+# Every robot is a holonomic point with a heading, commanded every period
+# seconds with the feedforward velocity of its setpoint plus a proportional
+# correction of its (measured) position and heading error.
+# velocity_noise: standard deviation of the velocity the robot actually gets (per axis)
+# position_noise, heading_noise: standard deviation of the measured pose
+# tolerance: relative margin before a velocity or acceleration counts as a violation.
+# Violations are checked against the constraints of each motion profile: speed
+# against max_vel, the rate of change of speed against max_acc and the heading rate against max_ang_vel
+class HeadlessSimulator:
+    def __init__(self, period=0.01, position_gain=5.0, heading_gain=5.0,
+                 velocity_noise=0.0, position_noise=0.0, heading_noise=0.0, tolerance=0.1, seed=None):
+        if period <= 0:
+            raise ValueError('The controller period must be positive')
+        self.period = period
+        self.position_gain = position_gain
+        self.heading_gain = heading_gain
+        self.velocity_noise = velocity_noise
+        self.position_noise = position_noise
+        self.heading_noise = heading_noise
+        self.tolerance = tolerance
+        self.rng = numpy.random.default_rng(seed)
+
+    # Simulates every motion profile (make_profile must have been called)
+    # and returns a SimulationResult
+    def run(self, motion_profiles):
+        if len(motion_profiles) == 0:
+            raise ValueError('Nothing to simulate')
+        start_time = time.perf_counter()
+        period = self.period
+        setpoints = [motion_profile.trajectory.sampled(period) for motion_profile in motion_profiles]
+        num_robots = len(setpoints)
+        num_ticks = max(len(setpoint) for setpoint in setpoints)
+
+        # (robots, ticks) setpoint arrays, robots that are done hold their last setpoint
+        def stack(field):
+            rows = numpy.empty((num_robots, num_ticks))
+            for robot, setpoint in enumerate(setpoints):
+                values = getattr(setpoint, field)
+                rows[robot, :len(values)] = values
+                rows[robot, len(values):] = values[-1]
+            return rows
+        x_ref, y_ref, heading_ref = stack('x'), stack('y'), stack('heading')
+        vx_ref, vy_ref = stack('vx'), stack('vy')
+        ticks = numpy.array([len(setpoint) for setpoint in setpoints])
+        for robot, length in enumerate(ticks):
+            vx_ref[robot, length:] = vy_ref[robot, length:] = 0
+        heading_rate_ref = numpy.zeros((num_robots, num_ticks))
+        heading_rate_ref[:, :-1] = wrap_angle(numpy.diff(heading_ref, axis=1)) / period
+
+        x, y, heading = x_ref[:, 0].copy(), y_ref[:, 0].copy(), heading_ref[:, 0].copy()
+        vx, vy, heading_rate = numpy.zeros(num_robots), numpy.zeros(num_robots), numpy.zeros(num_robots)
+        poses = numpy.empty((3, num_robots, num_ticks))
+        velocities = numpy.empty((3, num_robots, num_ticks))
+
+        for tick in range(num_ticks):
+            poses[:, :, tick] = x, y, heading
+            measured_x = x + self.rng.normal(0, self.position_noise, num_robots) if self.position_noise else x
+            measured_y = y + self.rng.normal(0, self.position_noise, num_robots) if self.position_noise else y
+            measured_heading = heading + self.rng.normal(0, self.heading_noise, num_robots) if self.heading_noise else heading
+
+            vx = vx_ref[:, tick] + self.position_gain * (x_ref[:, tick] - measured_x)
+            vy = vy_ref[:, tick] + self.position_gain * (y_ref[:, tick] - measured_y)
+            heading_rate = heading_rate_ref[:, tick] + self.heading_gain * wrap_angle(heading_ref[:, tick] - measured_heading)
+            if self.velocity_noise:
+                vx = vx + self.rng.normal(0, self.velocity_noise, num_robots)
+                vy = vy + self.rng.normal(0, self.velocity_noise, num_robots)
+            velocities[:, :, tick] = vx, vy, heading_rate
+
+            x = x + vx * period
+            y = y + vy * period
+            heading = heading + heading_rate * period
+
+        return SimulationResult(self, motion_profiles, setpoints, ticks, poses, velocities,
+                                time.perf_counter() - start_time)
+
+
+# Poses and velocities of a HeadlessSimulator run, with tracking error
+# and constraint violation statistics
+class SimulationResult:
+    def __init__(self, simulator, motion_profiles, setpoints, ticks, poses, velocities, elapsed):
+        self.simulator = simulator
+        self.motion_profiles = motion_profiles
+        self.setpoints = setpoints
+        self.ticks = ticks
+        self.poses = poses
+        self.velocities = velocities
+        self.elapsed = elapsed
+
+    # Statistics of robot i, only over the ticks of its own trajectory
+    def stats(self, i):
+        motion_profile = self.motion_profiles[i]
+        setpoint = self.setpoints[i]
+        period = self.simulator.period
+        tolerance = 1 + self.simulator.tolerance
+        x, y, heading = self.poses[:, i, :self.ticks[i]]
+        vx, vy, heading_rate = self.velocities[:, i, :self.ticks[i]]
+
+        errors = numpy.hypot(setpoint.x - x, setpoint.y - y)
+        heading_errors = numpy.abs(wrap_angle(setpoint.heading - heading))
+        lateral_errors = motion_profile.path.project_many(numpy.column_stack((x, y)), setpoint.s).lateral_error
+        speeds = numpy.hypot(vx, vy)
+        # Along the path, which is what max_acc limits
+        accelerations = numpy.abs(numpy.diff(speeds)) / period
+        return {
+            'duration': float(setpoint.t[-1] - setpoint.t[0]),
+            'max_error': float(errors.max()),
+            'rms_error': float(numpy.sqrt(numpy.mean(errors ** 2))),
+            'final_error': float(errors[-1]),
+            'max_lateral_error': float(numpy.abs(lateral_errors).max()),
+            'max_heading_error': float(heading_errors.max()),
+            'max_speed': float(speeds.max()),
+            'max_acceleration': float(accelerations.max(initial=0)),
+            'max_angular_velocity': float(numpy.abs(heading_rate).max()),
+            'velocity_violations': int(numpy.count_nonzero(speeds > motion_profile.max_vel * tolerance)),
+            'acceleration_violations': int(numpy.count_nonzero(accelerations > motion_profile.max_acc * tolerance)),
+            'angular_velocity_violations': int(numpy.count_nonzero(numpy.abs(heading_rate) > motion_profile.max_ang_vel * tolerance)),
+        }
+
+    # Worst and average statistics over all robots
+    def summary(self):
+        stats = [self.stats(i) for i in range(len(self.motion_profiles))]
+        simulated_time = sum(robot['duration'] for robot in stats)
+        return {
+            'robots': len(stats),
+            'ticks': int(self.ticks.sum()),
+            'elapsed': self.elapsed,
+            'realtime_factor': simulated_time / self.elapsed if self.elapsed > 0 else 0,
+            'max_error': max(robot['max_error'] for robot in stats),
+            'mean_rms_error': float(numpy.mean([robot['rms_error'] for robot in stats])),
+            'max_lateral_error': max(robot['max_lateral_error'] for robot in stats),
+            'max_heading_error': max(robot['max_heading_error'] for robot in stats),
+            'velocity_violations': sum(robot['velocity_violations'] for robot in stats),
+            'acceleration_violations': sum(robot['acceleration_violations'] for robot in stats),
+            'angular_velocity_violations': sum(robot['angular_velocity_violations'] for robot in stats),
+        }
+
+
+# Angles wrapped to [-pi, pi)
+def wrap_angle(angle):
+    return (angle + numpy.pi) % (2 * numpy.pi) - numpy.pi
+
+
+# Plans runs variations of the example routine, with every waypoint
+# moved randomly by up to jitter, and prints the summary as JSON.
+# Exits with 1 when any constraint was violated and --strict is given
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate many trajectories without a display')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--jitter', type=float, default=3.0)
+    parser.add_argument('--period', type=float, default=0.01)
+    parser.add_argument('--velocity-noise', type=float, default=0.0)
+    parser.add_argument('--position-noise', type=float, default=0.0)
+    parser.add_argument('--heading-noise', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--strict', action='store_true')
+    args = parser.parse_args(argv)
+
+    rng = numpy.random.default_rng(args.seed)
+    motion_profiles = []
+    for _ in range(args.runs):
+        path_builder = example_path_builder()
+        points = (numpy.array(path_builder.points) + rng.uniform(-args.jitter, args.jitter, (len(path_builder.points), 2))).tolist()
+        path = Path()
+        path.make_path(points, path_builder.tangent_angles, path_builder.headings)
+        motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
+        motion_profile.make_profile(start_vel=0, end_vel=0, num_points=int(path.length / 0.5))
+        motion_profiles.append(motion_profile)
+
+    simulator = HeadlessSimulator(args.period, velocity_noise=args.velocity_noise, position_noise=args.position_noise,
+                                  heading_noise=args.heading_noise, seed=args.seed)
+    summary = simulator.run(motion_profiles).summary()
+    print(json.dumps(summary, indent=2))
+    violations = summary['velocity_violations'] + summary['acceleration_violations'] + summary['angular_velocity_violations']
+    return 1 if args.strict and violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,12 +4,14 @@ environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
 import pygame
 import pygame.gfxdraw
 import time
+import argparse
 import numpy as np
-from scipy.integrate import cumulative_trapezoid
 
 from core.path import *
 from core.motion_profile import *
 from core.interp_lut import *
+from core.follower import LatencyStats
+from simulator.headless import example_path_builder
 
 width = 900
 height = 900
@@ -35,6 +37,11 @@ robot_width = 18
 robot_height = 18
 field_len = 142
 
+robot_colors = [(255, 255, 255), (255, 200, 0), (0, 200, 255), (255, 80, 80), (120, 255, 120)]
+
+# Frame time histogram bins in milliseconds, the last one catches everything slower
+frame_time_bins = [0, 1, 2, 4, 8, 16.7, 33.3, 50, 100, float('inf')]
+
 
 def rect(screen, center, width, height, angle_rad, color):
     cos_theta = math.cos(angle_rad)
@@ -49,49 +56,122 @@ def rect(screen, center, width, height, angle_rad, color):
     pygame.draw.lines(screen, color, True, vertices, 2)
 
 
-def main():
+# Maps field coordinates (scalars or arrays) to pixel coordinates, clamped to the field like map_range
+def to_pixels(values, size):
+    return np.interp(values, [-field_len / 2, field_len / 2], [0, size])
+
+
+# A planned trajectory being animated on the field
+class Robot:
+    def __init__(self, motion_profile, knots, color):
+        self.trajectory = motion_profile.trajectory
+        self.duration = motion_profile.duration
+        self.knots = knots
+        self.color = color
+        # Create one interpolated lookup table for the position and heading (in degrees)
+        # The cursor makes every frame continue from where the previous one stopped
+        lut_pose = InterpLUT(self.trajectory.t, np.column_stack((self.trajectory.x, self.trajectory.y,
+                                                                 np.degrees(self.trajectory.heading))))
+        self.pose_cursor = lut_pose.cursor()
+
+
+# The field with the path and knots of every robot drawn on it.
+# It only changes with the trajectories, so it is drawn once into a Surface
+# and blitted every frame until a robot gets a different trajectory
+class StaticLayer:
+    def __init__(self, field):
+        self.field = field
+        self.surface = None
+        self.trajectories = None
+        self.renders = 0
+
+    def draw(self, screen, robots):
+        trajectories = [robot.trajectory for robot in robots]
+        if self.surface is None or len(trajectories) != len(self.trajectories) or \
+                any(a is not b for a, b in zip(trajectories, self.trajectories)):
+            self.render(robots)
+            self.trajectories = trajectories
+        screen.blit(self.surface, (0, 0))
+
+    def invalidate(self):
+        self.surface = None
+
+    def render(self, robots):
+        self.surface = self.field.copy()
+        self.renders += 1
+        for robot in robots:
+            # Draw the path by mapping real coordinates to pixel coordinates
+            points = np.column_stack((to_pixels(robot.trajectory.x, width), to_pixels(robot.trajectory.y, height)))
+            pygame.draw.lines(self.surface, robot.color, False, points.tolist(), 4)
+
+            # Draw the knots by mapping real coordinates to pixel coordinates
+            knots = np.asarray(robot.knots, dtype=float)
+            for pixel_point in np.column_stack((to_pixels(knots[:, 0], width), to_pixels(knots[:, 1], height))).tolist():
+                pygame.draw.circle(self.surface, robot.color, tuple(pixel_point), 7)
+
+
+# Frame time and FPS overlay in the top left corner
+def draw_frame_stats(screen, font, frame_times):
+    mean = frame_times.mean()
+    text = 'FPS {0:5.0f}  frame {1:5.2f} ms  p99 {2:5.2f} ms  max {3:5.2f} ms'.format(
+        1 / mean if mean > 0 else 0, 1000 * mean, 1000 * frame_times.percentile(99), 1000 * frame_times.max)
+    screen.blit(font.render(text, True, (255, 255, 255), (0, 0, 0)), (5, 5))
+
+
+# Logs the frame time histogram with one bar per bin
+def print_frame_stats(frame_times):
+    counts, edges = frame_times.histogram(np.array(frame_time_bins) / 1000)
+    print('Frame times over the last {0} frames (mean {1:3.2f} ms, {2:3.0f} FPS):'.format(
+        sum(counts), 1000 * frame_times.mean(), 1 / frame_times.mean() if frame_times.mean() > 0 else 0))
+    for count, low, high in zip(counts, edges[:-1] * 1000, edges[1:] * 1000):
+        bar = '#' * int(round(50 * count / max(counts.max(), 1)))
+        print('  {0:6.1f} - {1:6.1f} ms {2:7d} {3}'.format(low, high, count, bar))
+
+
+# Plans the example routine, plus copies of it with every waypoint moved
+# randomly by up to jitter for the other robots
+def plan_robots(num_robots, jitter, seed=None):
+    rng = np.random.default_rng(seed)
+    robots = []
+    for i in range(num_robots):
+        path_builder = example_path_builder()
+        points = np.array(path_builder.points, dtype=float)
+        if i > 0:
+            points += rng.uniform(-jitter, jitter, points.shape)
+        path = Path()
+        path.make_path(points.tolist(), path_builder.tangent_angles, path_builder.headings)
+
+        # Create and construct the motion profile based on path and constraints
+        motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
+        motion_profile.make_profile(start_vel=0, end_vel=0, num_points=int(path.length / 0.5))
+        robots.append(Robot(motion_profile, points.tolist(), robot_colors[i % len(robot_colors)]))
+    return robots
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Animate planned trajectories on the field')
+    parser.add_argument('--robots', type=int, default=1)
+    parser.add_argument('--jitter', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats', action='store_true', help='show frame time statistics on screen')
+    args = parser.parse_args(argv)
+
     pygame.init()
     pygame.display.set_caption("Vlad's Path Planner")
     screen = pygame.display.set_mode((width, height))
     field = pygame.image.load("./simulator/field.png")
+    font = pygame.font.SysFont('monospace', 14)
     running = True
-    
+
     start_time = time.perf_counter()
-    # Create and build the path
-    path_builder = PathBuilder([36, -63.0], start_heading_deg=-10)
-    path_builder.point_linear_heading([30.0, -23], tangent_angle_deg=120, heading_deg=120)
-    path_builder.point_linear_heading([27, 0.5], tangent_angle_deg=45, heading_deg=45)
-    path_builder.point_constant_heading([45, -10.5], tangent_angle_deg=0)
-    path_builder.point_constant_heading([58.6, -9.5], tangent_angle_deg=15)
-    path = path_builder.build()
-    path_points = path_builder.points
-
-    # Create and construct the motion profile based on path and constraints
-    motion_profile = MotionProfile(path, max_vel, max_acc, max_ang_vel, max_ang_acc)
-    profile_x, profile_y = motion_profile.make_profile(start_vel=0, end_vel=0, num_points=int(path.length / 0.5))
-    heading_profile = motion_profile.heading_profile
-
-    # Get the velocity profiles for each axis
-    t = [point[0] for point in profile_x]
-    velocities_x = [point[1].velocity for point in profile_x]
-    velocities_y = [point[1].velocity for point in profile_y]
-
-    # Integrate them to obtain relative positions for each axis
-    # The start position is added to the relative positions
-    x_position = [path_points[0][0] + x_offset for x_offset in cumulative_trapezoid(velocities_x, t, initial=0)]
-    y_position = [path_points[0][1] + y_offset for y_offset in cumulative_trapezoid(velocities_y, t, initial=0)]
-    # Create the interpolated lookup tables for the position
-    lut_x = InterpLUT(t, x_position)
-    lut_y = InterpLUT(t, y_position)
-
-    # Get the heading
-    heading = [math.degrees(h[1]) for h in heading_profile]
-    lut_heading = InterpLUT(t, heading)
-
-    print('Trajectory generated in {0:3.2f} seconds'.format(time.perf_counter() - start_time))
-    print('Trajectory duration: {0:3.2f} seconds'.format(motion_profile.duration))
+    robots = plan_robots(args.robots, args.jitter, args.seed)
+    print('Trajectories generated in {0:3.2f} seconds'.format(time.perf_counter() - start_time))
+    print('Trajectory duration: {0:3.2f} seconds'.format(max(robot.duration for robot in robots)))
 
+    static_layer = StaticLayer(field)
+    frame_times = LatencyStats()
     start_time = time.perf_counter()
+    frame_start = start_time
     animation = True
 
     # main loop
@@ -99,45 +179,38 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
-        
-        screen.blit(field, (0, 0))
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                args.stats = not args.stats
+
+        # Field, paths and knots come from the cached layer
+        static_layer.draw(screen, robots)
 
         if animation is True:
-            # Draw the path by mapping real coordinates to pixel coordinates
-            x_path = [map_range(point, -field_len / 2, field_len / 2, 0, width) for point in x_position]
-            y_path = [map_range(point, -field_len / 2, field_len / 2, 0, width) for point in y_position]
-            points = list(zip(x_path, y_path))
-            pygame.draw.lines(screen, (255, 255, 255), False, points, 4)
+            # Get the elapsed time since the start of the animation, every robot starts over when it is done
+            elapsed = time.perf_counter() - start_time
+            for robot in robots:
+                rel_t = elapsed % robot.duration if robot.duration > 0 else 0
 
-            # Draw the knots by mapping real coordinates to pixel coordinates
-            for point in path_points:
-                pixel_point = [map_range(point[0], -field_len / 2, field_len / 2, 0, width), map_range(point[1], -field_len / 2, field_len / 2, 0, height)]
-                pygame.draw.circle(screen, (255, 255, 255), tuple(pixel_point), 7)
-
-            # Now draw the robot
-            # Get the elapsed time since the start of the animation of the trajectory
-            rel_t = time.perf_counter() - start_time
-            # Check if the trajectory is finished and reset
-            if rel_t > motion_profile.duration:
-                start_time = time.perf_counter()
-                screen.blit(field, (0, 0))
-                continue
-
-            # Get the pose of the robot at this time
-            x = lut_x.lookup(rel_t)
-            y = lut_y.lookup(rel_t)
-            angle = lut_heading.lookup(rel_t)
-
-            # Calculate the pixel coordinates and draw the rectangle
-            pixel_point_x = map_range(x, -field_len / 2, field_len / 2, 0, width)
-            pixel_point_y = map_range(y, -field_len / 2, field_len / 2, 0, height)
-            rect(screen, (pixel_point_x, pixel_point_y), robot_width / 2 * (width / field_len), robot_height / 2 * (height / field_len), math.radians(angle), (255, 255, 255))
-
-            # Display a progress indicator of the path
-            # For now, just print percentage
-            # print('Progress: ' + str(map_range(rel_t, 0, motion_profile.duration, 0, 100)) + '%')
+                # Get the pose of the robot at this time
+                x, y, angle = robot.pose_cursor.lookup(rel_t)
+
+                # Calculate the pixel coordinates and draw the rectangle
+                pixel_point_x = float(to_pixels(x, width))
+                pixel_point_y = float(to_pixels(y, height))
+                rect(screen, (pixel_point_x, pixel_point_y), robot_width / 2 * (width / field_len), robot_height / 2 * (height / field_len), math.radians(angle), robot.color)
+
+        if args.stats:
+            draw_frame_stats(screen, font, frame_times)
 
         pygame.display.update()
 
+        frame_end = time.perf_counter()
+        frame_times.record(frame_end - frame_start)
+        frame_start = frame_end
+
+    print_frame_stats(frame_times)
+    print('Static layer rendered {0} time(s)'.format(static_layer.renders))
+    pygame.quit()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()